@@ -0,0 +1,157 @@
+"""
+Regression checks for behaviour the benchmarks do not look at, run against the mock server where they need the network.
+
+- Incremental KoBo fetch (`fetch_kobo_data(cache_path=...)`): a first fetch fills the cache. New submissions are then
+  added and the newest cached one is edited. The second fetch must send the `_submission_time` watermark query and
+  download only the submissions at or after the watermark. Those are merged into the cache by `_id`, so the edit
+  replaces the cached row and nothing is duplicated. Both the flat and the `repeat_groups=True` layouts are checked.
+- SurveyCTO cache (`fetch_surveycto_data(cache_dir=...)`): the second fetch of an unchanged export is answered 304 and
+  returns the cached data; a changed export is downloaded again.
+- Attachment paths (`download_surveycto_photos`): a URL is saved to the same file whatever else is in the batch, and
+  a file listed in `previous_manifest` is not downloaded again.
+- Dashboard summaries (`raw_data_to_excel_with_all_charts`): a chart counting its own category column
+  (`category_col == value_col`) keeps both the categories and the counts, with and without `shared_summaries`.
+
+The exit status is non-zero on any failure:
+
+    python -m benchmarks.check_regressions
+"""
+import os
+import sys
+import tempfile
+
+import openpyxl
+import pandas as pd
+
+import orange2df2excel as o2e
+from orange2df2excel.fetch import _http_session
+from orange2df2excel.normalize import MAIN_TABLE
+from benchmarks.data import make_kobo_submissions, make_sessions
+from benchmarks.mock_server import MockApi, RedirectAdapter
+
+FIRST = 100
+ADDED = 10
+
+
+def check_kobo_incremental(workdir, repeat_groups):
+    """ Run the two fetches; returns a list of problems (empty if the check passed) """
+    submissions = make_kobo_submissions(FIRST + ADDED)
+    cache_path = os.path.join(workdir, f'kobo_{repeat_groups}.pkl')
+    problems = []
+    with MockApi(kobo_submissions=submissions[:FIRST]) as api:
+        base_url = f'{api.base_url}/api/v2'
+        o2e.fetch_kobo_data('token', 'form', base_url=base_url, page_size=40, cache_path=cache_path,
+                            repeat_groups=repeat_groups)
+        if any(query for query, _ in api.kobo_requests):
+            problems.append(f"first fetch sent a query: {api.kobo_requests}")
+
+        watermark = submissions[FIRST - 1]['_submission_time']
+        submissions[FIRST - 1]['group_session/donor'] = 'edited'
+        api.kobo_submissions = submissions
+        api.kobo_requests.clear()
+        result = o2e.fetch_kobo_data('token', 'form', base_url=base_url, page_size=40, cache_path=cache_path,
+                                     repeat_groups=repeat_groups)
+
+    expected_query = {'_submission_time': {'$gte': watermark}}
+    if not api.kobo_requests or any(query != expected_query for query, _ in api.kobo_requests):
+        problems.append(f"second fetch sent {[query for query, _ in api.kobo_requests]}, expected {expected_query}")
+    downloaded = sum(returned for _, returned in api.kobo_requests)
+    if downloaded != ADDED + 1:
+        problems.append(f"second fetch downloaded {downloaded} submissions, expected {ADDED + 1}")
+
+    df = result[MAIN_TABLE] if repeat_groups else result
+    ids = df['_id'].astype(int).tolist()
+    if sorted(ids) != list(range(1, FIRST + ADDED + 1)):
+        problems.append(f"merged data holds ids {sorted(ids)[:3]}... ({len(ids)} rows), expected 1..{FIRST + ADDED} once each")
+    edited = df.loc[df['_id'].astype(int) == FIRST, 'group_session/donor'].tolist()
+    if edited != ['edited']:
+        problems.append(f"the re-fetched submission {FIRST} holds {edited}, expected ['edited']")
+    if repeat_groups:
+        members = result['members']
+        expected_members = 2 * len(range(0, FIRST + ADDED, 3))
+        if len(members) != expected_members:
+            problems.append(f"members table holds {len(members)} rows, expected {expected_members}")
+    return problems
+
+
+def check_surveycto_cache(workdir):
+    """ Fetch an unchanged then a changed export through the cache; returns a list of problems """
+    first, changed = make_sessions(50, seed=1), make_sessions(60, seed=2)
+    cache_dir = os.path.join(workdir, 'surveycto')
+    problems = []
+    with MockApi(surveycto_csv=first.to_csv(index=False).encode()) as api:
+        session = _http_session()
+        session.mount('https://check.surveycto.com', RedirectAdapter(api.base_url))
+
+        def fetch():
+            return o2e.fetch_surveycto_data(False, 'check', 'form', 'user', 'password', cache_dir=cache_dir)
+
+        try:
+            results = [fetch(), fetch()]
+            api.surveycto_csv = changed.to_csv(index=False).encode()
+            results.append(fetch())
+        finally:
+            session.adapters.pop('https://check.surveycto.com', None)
+
+    if api.surveycto_statuses != [200, 304, 200]:
+        problems.append(f"server answered {api.surveycto_statuses}, expected [200, 304, 200]")
+    for result, expected, label in zip(results, [first, first, changed], ['first', 'cached', 'changed']):
+        if result is None or len(result) != len(expected) or result['donor'].tolist() != expected['donor'].tolist():
+            problems.append(f"{label} fetch returned {None if result is None else len(result)} rows, expected {len(expected)}")
+    return problems
+
+
+def check_attachment_paths(workdir):
+    """ Download overlapping batches of attachments; returns a list of problems """
+    save_dir = os.path.join(workdir, 'photos')
+    problems = []
+    with MockApi(surveycto_csv=b'photo') as api:
+        a, b = f'{api.base_url}/a/photo.jpg', f'{api.base_url}/b/photo.jpg'
+        both = o2e.download_surveycto_photos([a, b], save_dir, 'user', 'password')
+        alone = o2e.download_surveycto_photos([b], save_dir, 'user', 'password', previous_manifest=both)
+
+    paths = dict(zip(both['url'], both['path']))
+    if paths[a] == paths[b]:
+        problems.append(f"{a} and {b} share the path {paths[a]}")
+    if alone['path'].tolist() != [paths[b]]:
+        problems.append(f"{b} was saved to {alone['path'].tolist()} alone, {paths[b]} in a batch")
+    if alone['status'].tolist() != ['skipped']:
+        problems.append(f"{b} listed in previous_manifest has status {alone['status'].tolist()}, expected ['skipped']")
+    return problems
+
+
+def check_dashboard_self_count(workdir, shared_summaries):
+    """ Chart a column against itself; returns a list of problems """
+    df = pd.DataFrame({'donor': ['x', 'x', 'y', 'z'], 'n': [1, 2, 3, 4]})
+    chart_config = {'pie': {'category_col': 'donor', 'value_col': 'donor'},
+                    'bar': {'category_col': 'donor', 'value_col': 'n'}}
+    path = os.path.join(workdir, f'dashboard_{shared_summaries}.xlsx')
+    o2e.raw_data_to_excel_with_all_charts(df, path, chart_config, shared_summaries=shared_summaries)
+    rows = [row[:2] for row in openpyxl.load_workbook(path)['Dashboard'].iter_rows(max_row=4, values_only=True)]
+    expected = [('donor', 'donor'), ('x', 2), ('y', 1), ('z', 1)]
+    return [] if rows == expected else [f"dashboard summary starts with {rows}, expected {expected}"]
+
+
+CHECKS = [
+    ('fetch_kobo_data(cache_path=...)', lambda workdir: check_kobo_incremental(workdir, False)),
+    ('fetch_kobo_data(cache_path=..., repeat_groups=True)', lambda workdir: check_kobo_incremental(workdir, True)),
+    ('fetch_surveycto_data(cache_dir=...)', check_surveycto_cache),
+    ('download_surveycto_photos paths', check_attachment_paths),
+    ('dashboard category_col == value_col', lambda workdir: check_dashboard_self_count(workdir, False)),
+    ('dashboard category_col == value_col, shared', lambda workdir: check_dashboard_self_count(workdir, True)),
+]
+
+
+def main(argv=None):
+    failures = 0
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, check in CHECKS:
+            problems = check(workdir)
+            failures += bool(problems)
+            status = 'FAIL ' + '; '.join(problems) if problems else 'ok'
+            print(f"{name:<56}  {status}", flush=True)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
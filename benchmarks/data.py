@@ -0,0 +1,110 @@
+"""
+Synthetic data generators for the benchmarks.
+
+The frames look like KoBo/SurveyCTO session exports: a few low-cardinality text columns (donor, settlement,
+enumerator), dates, counts and free text. "wide" frames add 100 extra survey answer columns.
+"""
+import operator
+
+import numpy as np
+import pandas as pd
+
+SCALES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+DONORS = ['UNICEF', 'WFP: Emergency', 'EU, ECHO', 'USAID', 'Save the Children']
+SETTLEMENTS = ['Kyiv', 'Lviv city', 'Odesa', 'Kharkiv: center', 'Dnipro', 'Zaporizhzhia']
+ENUMERATORS = ['Ivan Petrenko', 'Olga Shevchenko', 'Anna, K', 'Mykola', 'Li']
+FIRST_NAMES = ['Olena', 'Ivan', 'Maria', 'Petro', 'Yu', 'Andriy', 'Sofiia']
+SURNAMES = ['Kovalenko', 'Bondarenko', 'Tkachenko', 'Li', 'Melnyk', 'Shevchuk']
+
+
+def make_sessions(rows, wide=False, seed=0):
+    """ Session-level export with the columns used by `generate_session_id` """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'donor': rng.choice(DONORS, rows),
+        'settlement': rng.choice(SETTLEMENTS, rows),
+        'enumerator': rng.choice(ENUMERATORS, rows),
+        'session_date': pd.Series(pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365, rows), unit='D')).dt.strftime('%Y-%m-%d'),
+        'total_bnf': rng.integers(1, 60, rows),
+        'comment': rng.choice(['', 'All good', 'Rain, session moved indoors', None], rows),
+        'girls': rng.integers(0, 15, rows),
+        'boys': rng.integers(0, 15, rows),
+        'women': rng.integers(0, 15, rows),
+        'men': rng.integers(0, 15, rows),
+        'cost': rng.random(rows) * 100,
+    })
+    if wide:
+        extra = pd.DataFrame(rng.integers(0, 5, (rows, 100)), columns=[f'q{i:03d}' for i in range(100)])
+        df = pd.concat([df, extra], axis=1)
+    return df
+
+
+def make_registrations(rows, seed=0):
+    """ Beneficiary registrations with the columns used by `generate_bnf_id` """
+    rng = np.random.default_rng(seed)
+    dob = pd.Timestamp('1950-01-01') + pd.to_timedelta(rng.integers(0, 25_000, rows), unit='D')
+    return pd.DataFrame({
+        'name': rng.choice(FIRST_NAMES, rows),
+        'surname': rng.choice(SURNAMES, rows),
+        'dob': pd.Series(dob).dt.strftime('%Y-%m-%d'),
+        'phone': pd.Series(rng.integers(380_500_000_000, 380_999_999_999, rows)).astype(str),
+    })
+
+
+def make_kobo_submissions(rows, seed=0):
+    """ KoBo v2 `results` records, including a repeat group on every third submission """
+    rng = np.random.default_rng(seed)
+    donors = rng.choice(DONORS, rows)
+    counts = rng.integers(0, 60, rows)
+    submissions = []
+    for i in range(rows):
+        submission = {
+            '_id': i + 1,
+            '_uuid': f'uuid-{i + 1}',
+            '_submission_time': f'2024-01-01T00:{(i // 60) % 60:02d}:{i % 60:02d}',
+            'group_session/donor': str(donors[i]),
+            'group_session/total_bnf': str(counts[i]),
+        }
+        if i % 3 == 0:
+            submission['members'] = [{'members/name': 'A', 'members/age': '12'}, {'members/name': 'B', 'members/age': '40'}]
+        submissions.append(submission)
+    return submissions
+
+
+def make_json_records(rows, seed=0):
+    """ Records as passed to `encrypt_json_data` """
+    return make_registrations(rows, seed).to_dict('records')
+
+
+def write_binary_file(path, size, seed=0):
+    """ Random binary file of `size` bytes, written in 1 MiB blocks """
+    rng = np.random.default_rng(seed)
+    with open(path, 'wb') as file:
+        remaining = size
+        while remaining:
+            block = min(remaining, 1024 * 1024)
+            file.write(rng.integers(0, 256, block, dtype=np.uint8).tobytes())
+            remaining -= block
+
+
+_QUERY_OPERATORS = {'$gt': operator.gt, '$gte': operator.ge, '$lt': operator.lt, '$lte': operator.le}
+
+
+def _matches(submission, query):
+    """ True if `submission` matches a KoBo (Mongo-style) `query` made of equalities and $gt/$gte/$lt/$lte """
+    for field, condition in query.items():
+        value = submission.get(field)
+        if not isinstance(condition, dict):
+            if value != condition:
+                return False
+        elif value is None or not all(_QUERY_OPERATORS[name](value, operand) for name, operand in condition.items()):
+            return False
+    return True
+
+
+def kobo_page(submissions, start=0, limit=None, query=None):
+    """ (count, results) answered to a KoBo `data.json` request: the submissions matching `query`, then one page of them """
+    if query:
+        submissions = [submission for submission in submissions if _matches(submission, query)]
+    return len(submissions), submissions[start:None if limit is None else start + limit]
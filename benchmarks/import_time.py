@@ -0,0 +1,86 @@
+"""
+Import-time regression check for orange2df2excel.
+
+Each case imports the package (or one name from it) in a fresh interpreter, then checks which heavy dependencies
+were loaded and how long the import took. A case fails if a forbidden module shows up in `sys.modules`, or if its
+median import time exceeds `--budget-ms` (when given). The exit status is non-zero on any failure, so this can run in CI:
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --repeat 10 --budget-ms 150
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY = ['pandas', 'numpy', 'openpyxl', 'xlsxwriter', 'requests', 'koboextractor', 'cryptography', 'Crypto', 'bcrypt', 'pyarrow']
+
+# (statement, dependencies that must not be imported by it)
+CASES = [
+    ("import orange2df2excel", HEAVY),
+    ("from orange2df2excel import add_metrics_hook", HEAVY),
+    ("from orange2df2excel import decrypt_value",
+     ['pandas', 'numpy', 'openpyxl', 'xlsxwriter', 'requests', 'koboextractor', 'Crypto', 'bcrypt']),
+    ("from orange2df2excel import KeySession",
+     ['pandas', 'numpy', 'openpyxl', 'xlsxwriter', 'requests', 'koboextractor', 'bcrypt']),
+    ("from orange2df2excel import generate_bnf_id", HEAVY),
+    ("from orange2df2excel import fetch_surveycto_data",
+     ['openpyxl', 'xlsxwriter', 'cryptography', 'Crypto', 'bcrypt']),
+    ("from orange2df2excel import normalize_kobo_submissions",
+     ['openpyxl', 'xlsxwriter', 'requests', 'koboextractor', 'cryptography', 'Crypto', 'bcrypt']),
+    ("from orange2df2excel import raw_data_to_excel",
+     ['requests', 'koboextractor', 'cryptography', 'Crypto', 'bcrypt']),
+    ("from orange2df2excel import write_columnar",
+     ['openpyxl', 'xlsxwriter', 'requests', 'koboextractor', 'cryptography', 'Crypto', 'bcrypt']),
+]
+
+_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'modules': sorted({{name.split('.')[0] for name in sys.modules}})}}))
+"""
+
+
+def probe(statement):
+    """ Run `statement` in a fresh interpreter; returns (import seconds, top-level module names loaded) """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')])))
+    output = subprocess.run(
+        [sys.executable, '-c', _PROBE.format(statement=statement)],
+        check=True, capture_output=True, text=True, env=env,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result['seconds'], set(result['modules'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per case')
+    parser.add_argument('--budget-ms', type=float, help='fail cases whose median import time exceeds this')
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for statement, forbidden in CASES:
+        times = []
+        for _ in range(args.repeat):
+            seconds, modules = probe(statement)
+            times.append(seconds)
+        median_ms = statistics.median(times) * 1000
+        loaded = sorted(set(forbidden) & modules)
+        problems = []
+        if loaded:
+            problems.append(f"loads {', '.join(loaded)}")
+        if args.budget_ms is not None and median_ms > args.budget_ms:
+            problems.append(f"over the {args.budget_ms:.0f} ms budget")
+        failures += bool(problems)
+        status = 'FAIL ' + '; '.join(problems) if problems else 'ok'
+        print(f"{statement:<56}{median_ms:9.1f} ms  {status}", flush=True)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
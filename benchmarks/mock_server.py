@@ -0,0 +1,104 @@
+"""
+Local HTTP server mimicking the KoBo v2 data API and the SurveyCTO CSV API for the fetch benchmarks.
+"""
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from benchmarks.data import kobo_page
+
+
+class MockApi:
+    """
+    Serves `/api/v2/assets/<form>/data.json` (KoBo) and any other path as the SurveyCTO CSV body.
+
+    KoBo requests honour `start`/`limit` and the comparisons of a `query` on submission fields (e.g. the
+    `{"_submission_time": {"$gte": ...}}` watermark of incremental fetches). Each request is recorded in
+    `kobo_requests` as (query or None, number of submissions returned).
+
+    SurveyCTO responses carry an `ETag` (a hash of the body) and the `Last-Modified` date in `surveycto_last_modified`,
+    and conditional requests whose validators still match are answered 304. The status of each SurveyCTO request is
+    recorded in `surveycto_statuses`.
+    """
+
+    def __init__(self, kobo_submissions=None, surveycto_csv=b''):
+        self.kobo_submissions = kobo_submissions or []
+        self.surveycto_csv = surveycto_csv
+        self.surveycto_last_modified = 'Mon, 01 Jan 2024 00:00:00 GMT'
+        self.kobo_requests = []
+        self.surveycto_statuses = []
+        self.server = None
+
+    def __enter__(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                headers = {}
+                if url.path.endswith('/data.json'):
+                    query = parse_qs(url.query)
+                    start = int(query.get('start', ['0'])[0])
+                    limit = int(query['limit'][0]) if 'limit' in query else None
+                    kobo_query = json.loads(query['query'][0]) if 'query' in query else None
+                    count, results = kobo_page(api.kobo_submissions, start, limit, kobo_query)
+                    api.kobo_requests.append((kobo_query, len(results)))
+                    body, content_type = json.dumps({'count': count, 'results': results}).encode(), 'application/json'
+                else:
+                    body, content_type = api.surveycto_csv, 'text/csv'
+                    headers = {'ETag': f'"{hashlib.sha1(body).hexdigest()[:16]}"',
+                               'Last-Modified': api.surveycto_last_modified}
+                    if_none_match = self.headers.get('If-None-Match')
+                    if (if_none_match == headers['ETag'] if if_none_match is not None
+                            else self.headers.get('If-Modified-Since') == headers['Last-Modified']):
+                        api.surveycto_statuses.append(304)
+                        self.send_response(304)
+                        for name, value in headers.items():
+                            self.send_header(name, value)
+                        self.end_headers()
+                        return
+                    api.surveycto_statuses.append(200)
+                self.send_response(200)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+
+class RedirectAdapter(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter sending requests for a real host to the mock server, so functions with hard-coded
+    endpoints (like `fetch_surveycto_data`) can be benchmarked end to end.
+    """
+
+    def __init__(self, target_base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.target_base_url = target_base_url
+
+    def send(self, request, **kwargs):
+        url = urlparse(request.url)
+        request.url = f"{self.target_base_url}{url.path}{'?' + url.query if url.query else ''}"
+        return super().send(request, **kwargs)
@@ -0,0 +1,303 @@
+"""
+Benchmark suite for orange2df2excel.
+
+Every benchmark is run at the requested scales on synthetic data (see `benchmarks/data.py`). Wall time is the
+minimum and median of `--repeat` runs; peak memory is measured with `tracemalloc` in one extra run (skip it with
+`--no-memory`). Results are
+written as JSON together with the package version, Python version and git commit, so runs can be compared:
+
+    python -m benchmarks.run_benchmarks --scales 10k,100k --output before.json
+    python -m benchmarks.run_benchmarks --scales 10k,100k --output after.json --compare before.json
+
+Fetch benchmarks run against a local mock HTTP server (see `benchmarks/mock_server.py`).
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import orange2df2excel as o2e
+from benchmarks.data import (SCALES, make_json_records, make_kobo_submissions, make_registrations, make_sessions,
+                             write_binary_file)
+from benchmarks.mock_server import MockApi, RedirectAdapter
+
+BENCHMARKS = []
+
+KEY = bytes(range(32))
+SESSION_ARGS = ('donor', 'settlement', 'enumerator', 'session_date', 'PRJ', 'total_bnf', 'comment',
+                'girls', 'boys', 'women', 'men')
+CHART_CONFIG = {
+    'bar': {'category_col': 'donor', 'value_col': 'total_bnf'},
+    'pie': {'category_col': 'donor', 'value_col': 'comment'},
+    'line': {'category_col': 'settlement', 'value_col': 'cost'},
+}
+
+
+def benchmark(name, shapes=('narrow',)):
+    """
+    Register a benchmark. The decorated function receives (rows, shape, workdir, stack), prepares its data and
+    returns the callable that is timed; `stack` is an ExitStack for resources that must outlive the setup.
+    """
+    def register(setup):
+        BENCHMARKS.append((name, shapes, setup))
+        return setup
+    return register
+
+
+@benchmark('raw_data_to_excel', shapes=('narrow', 'wide'))
+def _raw_data_to_excel(rows, shape, workdir, stack):
+    df = make_sessions(rows, wide=shape == 'wide')
+    path = os.path.join(workdir, 'raw.xlsx')
+    return lambda: (_remove(path), o2e.raw_data_to_excel(df, path, 'raw data'))
+
+
+@benchmark('raw_data_to_excel[streaming]', shapes=('narrow', 'wide'))
+def _raw_data_to_excel_streaming(rows, shape, workdir, stack):
+    df = make_sessions(rows, wide=shape == 'wide')
+    path = os.path.join(workdir, 'raw_streaming.xlsx')
+    return lambda: (_remove(path), o2e.raw_data_to_excel(df, path, 'raw data', streaming=True))
+
+
+@benchmark('raw_data_to_excel_with_all_charts', shapes=('narrow', 'wide'))
+def _raw_data_to_excel_with_all_charts(rows, shape, workdir, stack):
+    df = make_sessions(rows, wide=shape == 'wide')
+    path = os.path.join(workdir, 'dashboard.xlsx')
+    return lambda: o2e.raw_data_to_excel_with_all_charts(df, path, CHART_CONFIG, totals=['total_bnf', 'cost', 'donor'])
+
+
+@benchmark('raw_data_to_excel_with_all_charts[no raw]')
+def _dashboard_only(rows, shape, workdir, stack):
+    df = make_sessions(rows)
+    path = os.path.join(workdir, 'dashboard_only.xlsx')
+    return lambda: o2e.raw_data_to_excel_with_all_charts(df, path, CHART_CONFIG, totals=['total_bnf', 'cost', 'donor'],
+                                                         raw_data_rows=0)
+
+
+@benchmark('raw_data_to_excel_with_all_charts[cached]')
+def _dashboard_only_cached(rows, shape, workdir, stack):
+    # Same as [no raw], with the aggregates already cached: every timed run is a cache hit
+    df = make_sessions(rows)
+    path = os.path.join(workdir, 'dashboard_cached.xlsx')
+
+    def run():
+        o2e.raw_data_to_excel_with_all_charts(df, path, CHART_CONFIG, totals=['total_bnf', 'cost', 'donor'],
+                                              raw_data_rows=0, cache_aggregations=True)
+    run()
+    return run
+
+
+@benchmark('generate_session_id')
+def _generate_session_id(rows, shape, workdir, stack):
+    df = make_sessions(rows)
+    return lambda: o2e.generate_session_id(df, *SESSION_ARGS, copy=True)
+
+
+@benchmark('generate_bnf_id[apply]')
+def _generate_bnf_id(rows, shape, workdir, stack):
+    df = make_registrations(rows)
+    return lambda: [o2e.generate_bnf_id(n, s, d) for n, s, d in zip(df['name'], df['surname'], df['dob'])]
+
+
+@benchmark('generate_bnf_ids')
+def _generate_bnf_ids(rows, shape, workdir, stack):
+    df = make_registrations(rows)
+    return lambda: o2e.generate_bnf_ids(df, 'name', 'surname', 'dob')
+
+
+@benchmark('encrypt_value[apply]')
+def _encrypt_value(rows, shape, workdir, stack):
+    values = make_registrations(rows)['phone']
+    return lambda: values.apply(o2e.encrypt_value, key=KEY)
+
+
+@benchmark('decrypt_value[apply]')
+def _decrypt_value(rows, shape, workdir, stack):
+    values = o2e.encrypt_columns(make_registrations(rows), ['phone'], KEY)['phone']
+    return lambda: values.apply(o2e.decrypt_value, key=KEY)
+
+
+@benchmark('encrypt_columns')
+def _encrypt_columns(rows, shape, workdir, stack):
+    df = make_registrations(rows)
+    return lambda: o2e.encrypt_columns(df, ['name', 'surname', 'phone'], KEY)
+
+
+@benchmark('encrypt_json_data')
+def _encrypt_json_data(rows, shape, workdir, stack):
+    records = make_json_records(rows)
+    return lambda: [o2e.encrypt_json_data(record, KEY) for record in records]
+
+
+@benchmark('encrypt_file')
+def _encrypt_file(rows, shape, workdir, stack):
+    source = os.path.join(workdir, 'plain.bin')
+    write_binary_file(source, rows * 100)
+    return lambda: o2e.encrypt_file(source, os.path.join(workdir, 'plain.en'), KEY)
+
+
+@benchmark('encrypt_file_segmented')
+def _encrypt_file_segmented(rows, shape, workdir, stack):
+    source = os.path.join(workdir, 'plain_segmented.bin')
+    write_binary_file(source, rows * 100)
+    return lambda: o2e.encrypt_file_segmented(source, os.path.join(workdir, 'plain.seg'), KEY)
+
+
+@benchmark('fetch_kobo_data')
+def _fetch_kobo_data(rows, shape, workdir, stack):
+    api = stack.enter_context(MockApi(kobo_submissions=make_kobo_submissions(rows)))
+    return lambda: o2e.fetch_kobo_data('token', 'bench', base_url=f'{api.base_url}/api/v2')
+
+
+@benchmark('fetch_kobo_data[paginated]')
+def _fetch_kobo_data_paginated(rows, shape, workdir, stack):
+    api = stack.enter_context(MockApi(kobo_submissions=make_kobo_submissions(rows)))
+    page_size = max(1000, rows // 8)
+    return lambda: o2e.fetch_kobo_data('token', 'bench', base_url=f'{api.base_url}/api/v2', page_size=page_size)
+
+
+@benchmark('fetch_surveycto_data')
+def _fetch_surveycto_data(rows, shape, workdir, stack):
+    _mock_surveycto(rows, stack)
+    return lambda: o2e.fetch_surveycto_data(False, 'bench', 'form', 'user', 'password')
+
+
+@benchmark('surveycto_to_excel[sequential]')
+def _surveycto_to_excel_sequential(rows, shape, workdir, stack):
+    _mock_surveycto(rows, stack)
+    path = os.path.join(workdir, 'sequential.xlsx')
+
+    def run():
+        df = o2e.fetch_surveycto_data(False, 'bench', 'form', 'user', 'password')
+        df = o2e.encrypt_columns(o2e.generate_session_id(df, *SESSION_ARGS), ['enumerator', 'comment'], KEY)
+        o2e.raw_data_to_excel(df, path, 'raw data', streaming=True)
+    return run
+
+
+@benchmark('surveycto_to_excel[pipeline]')
+def _surveycto_to_excel_pipeline(rows, shape, workdir, stack):
+    _mock_surveycto(rows, stack)
+    path = os.path.join(workdir, 'pipeline.xlsx')
+
+    def run():
+        chunks = o2e.fetch_surveycto_data(False, 'bench', 'form', 'user', 'password', chunksize=max(1000, rows // 10))
+        (o2e.Pipeline(chunks)
+            .add_stage(o2e.generate_session_id, *SESSION_ARGS)
+            .add_stage(o2e.encrypt_columns, ['enumerator', 'comment'], KEY)
+            .set_sink(o2e.raw_data_to_excel, path, 'raw data')
+            .run())
+    return run
+
+
+def _mock_surveycto(rows, stack):
+    """ Serve a sessions CSV export and route https://bench.surveycto.com to it """
+    from orange2df2excel.fetch import _http_session
+
+    api = stack.enter_context(MockApi(surveycto_csv=make_sessions(rows).to_csv(index=False).encode()))
+    session = _http_session()
+    session.mount('https://bench.surveycto.com', RedirectAdapter(api.base_url))
+    stack.callback(session.adapters.pop, 'https://bench.surveycto.com', None)
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def measure(run, repeat, memory=True):
+    """ Time `run` `repeat` times, then (unless `memory` is False) run it once more under tracemalloc for the peak memory """
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        if not memory:
+            return {'min_s': min(times), 'median_s': statistics.median(times), 'peak_mb': None}
+        tracemalloc.start()
+        try:
+            run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return {'min_s': min(times), 'median_s': statistics.median(times), 'peak_mb': peak / 2 ** 20}
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare(results, baseline_path):
+    """ Print time and memory ratios against an earlier results file (ratio > 1 means slower / larger) """
+    with open(baseline_path) as baseline_file:
+        baseline = {
+            (entry['name'], entry['scale'], entry['shape']): entry for entry in json.load(baseline_file)['results']
+        }
+    print(f"\n{'benchmark':<42}{'scale':>7}{'shape':>8}{'time x':>9}{'memory x':>10}")
+    for entry in results:
+        previous = baseline.get((entry['name'], entry['scale'], entry['shape']))
+        if previous is None:
+            continue
+        time_ratio = entry['min_s'] / previous['min_s'] if previous['min_s'] else float('nan')
+        memory_ratio = entry['peak_mb'] / previous['peak_mb'] if entry['peak_mb'] and previous['peak_mb'] else float('nan')
+        print(f"{entry['name']:<42}{entry['scale']:>7}{entry['shape']:>8}{time_ratio:>9.2f}{memory_ratio:>10.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='10k', help=f"comma-separated scales among {', '.join(SCALES)}")
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this text')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run (it slows pure-Python code down a lot)')
+    parser.add_argument('--output', default='benchmark_results.json', help='where to write the JSON results')
+    parser.add_argument('--compare', help='earlier JSON results to compare against')
+    args = parser.parse_args(argv)
+
+    results = []
+    for scale in args.scales.split(','):
+        rows = SCALES[scale]
+        for name, shapes, setup in BENCHMARKS:
+            if args.filter not in name:
+                continue
+            for shape in shapes:
+                workdir = tempfile.mkdtemp(prefix='o2e-bench-')
+                try:
+                    with contextlib.ExitStack() as stack:
+                        run = setup(rows, shape, workdir, stack)
+                        timings = measure(run, args.repeat, memory=not args.no_memory)
+                        entry = {'name': name, 'scale': scale, 'rows': rows, 'shape': shape, **timings}
+                finally:
+                    shutil.rmtree(workdir, ignore_errors=True)
+                results.append(entry)
+                peak = 'n/a' if entry['peak_mb'] is None else f"{entry['peak_mb']:.1f}"
+                print(f"{name:<42}{scale:>7}{shape:>8}  min {entry['min_s']:8.3f}s  "
+                      f"median {entry['median_s']:8.3f}s  peak {peak:>9} MiB", flush=True)
+
+    with open(args.output, 'w') as output_file:
+        json.dump({'meta': metadata(), 'results': results}, output_file, indent=2)
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,63 @@
-from .orange_tools import raw_data_to_excel, raw_data_to_excel_with_all_charts
-from .orange_tools import fetch_kobo_data
-from .orange_tools import fetch_surveycto_data
-from .orange_tools import generate_bnf_id, generate_session_id
-from .orange_tools import gen_encryption_key, encrypt_value, decrypt_value, rederive_key, hash_password, download_surveycto_photo, save_photo_from_bytes
-from .orange_tools import encrypt_photo_for_sql, decrypt_photo_for_sql, encrypt_json_data, decrypt_json_data
\ No newline at end of file
+# Public names are loaded lazily (PEP 562): `from orange2df2excel import decrypt_value` only imports the `crypto`
+# submodule and its dependencies, not pandas, openpyxl or requests.
+import importlib
+
+_EXPORTS = {
+    'raw_data_to_excel': 'excel',
+    'raw_data_to_excel_with_all_charts': 'excel',
+    'compute_column_widths': 'excel',
+    'raw_data_to_excel_batch': 'excel',
+    'export_workbooks': 'excel',
+    'write_columnar': 'columnar',
+    'read_columnar': 'columnar',
+    'fetch_kobo_data': 'fetch',
+    'fetch_surveycto_data': 'fetch',
+    'download_surveycto_photo': 'fetch',
+    'download_surveycto_photos': 'fetch',
+    'save_photo_from_bytes': 'fetch',
+    'normalize_kobo_submissions': 'normalize',
+    'compact_dtypes': 'normalize',
+    'generate_bnf_id': 'ids',
+    'generate_session_id': 'ids',
+    'generate_bnf_ids': 'ids',
+    'IdIndex': 'ids',
+    'gen_encryption_key': 'crypto',
+    'encrypt_value': 'crypto',
+    'decrypt_value': 'crypto',
+    'rederive_key': 'crypto',
+    'hash_password': 'crypto',
+    'verify_password': 'crypto',
+    'hash_passwords': 'crypto',
+    'verify_passwords': 'crypto',
+    'calibrate_bcrypt_rounds': 'crypto',
+    'encrypt_columns': 'crypto',
+    'decrypt_columns': 'crypto',
+    'KeySession': 'crypto',
+    'clear_key_cache': 'crypto',
+    'encrypt_file': 'crypto',
+    'decrypt_file': 'crypto',
+    'encrypt_file_segmented': 'crypto',
+    'decrypt_file_segmented': 'crypto',
+    'decrypt_file_range': 'crypto',
+    'encrypt_photo_for_sql': 'crypto',
+    'decrypt_photo_for_sql': 'crypto',
+    'encrypt_json_data': 'crypto',
+    'decrypt_json_data': 'crypto',
+    'encrypt_to_sql': 'crypto',
+    'Pipeline': 'pipeline',
+    'add_metrics_hook': 'metrics',
+    'remove_metrics_hook': 'metrics',
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,146 @@
+"""Columnar side outputs: Parquet and Arrow IPC files next to the Excel exports, for loading the full data quickly.
+
+pyarrow is optional (`pip install orange2df2excel[columnar]`) and only imported when a file is written or read.
+"""
+import os
+import logging
+
+import pandas as pd
+
+from .metrics import _instrumented, _stage, _count
+
+logger = logging.getLogger(__name__)
+
+_FORMATS = {
+    '.parquet': 'parquet',
+    '.pq': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.ipc': 'arrow',
+}
+
+def _import_pyarrow():
+    """ Import pyarrow, with a hint on how to install it """
+    try:
+        import pyarrow
+    except ImportError as error:
+        raise ImportError("Columnar files need pyarrow: pip install orange2df2excel[columnar]") from error
+    return pyarrow
+
+def _columnar_format(path, file_format=None):
+    """ 'parquet' or 'arrow', from `file_format` if given, otherwise from the file extension """
+    if file_format is None:
+        file_format = _FORMATS.get(os.path.splitext(str(path))[1].lower())
+        if file_format is None:
+            raise ValueError(f"Cannot tell the columnar format of '{path}'; use a .parquet or .arrow extension or pass file_format.")
+    if file_format not in ('parquet', 'arrow'):
+        raise ValueError("file_format must be 'parquet' or 'arrow'.")
+    return file_format
+
+class _ColumnarWriter:
+    """
+    Incremental Parquet / Arrow IPC writer fed one DataFrame chunk at a time.
+
+    The schema is taken from the first chunk and later chunks are cast to it, so a column must keep a compatible
+    type across chunks. The file is created on the first `write`; `abort` removes a partially written file.
+    """
+
+    def __init__(self, path, file_format=None):
+        self.path = path
+        self.file_format = _columnar_format(path, file_format)
+        self.rows = 0
+        self._schema = None
+        self._writer = None
+
+    def write(self, chunk):
+        pa = _import_pyarrow()
+        table = pa.Table.from_pandas(chunk, schema=self._schema, preserve_index=False)
+        if self._writer is None:
+            self._schema = table.schema
+            if self.file_format == 'parquet':
+                import pyarrow.parquet as pq
+                self._writer = pq.ParquetWriter(self.path, self._schema)
+            else:
+                self._writer = pa.ipc.new_file(self.path, self._schema)
+        self._writer.write_table(table)
+        self.rows += len(chunk)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            logger.info("%d rows written to %s", self.rows, self.path)
+
+    def abort(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+@_instrumented
+def write_columnar(data, path, file_format=None):
+    """
+    Write a DataFrame, or an iterable of DataFrame chunks, to a Parquet or Arrow IPC file.
+
+    Parameters:
+    - data: pandas.DataFrame or iterable of pandas.DataFrame - The data to write. Chunks are written one at a time,
+      so the whole dataset never has to be in memory; every chunk must have the columns and types of the first.
+    - path: str - Path of the file to write.
+    - file_format: str - 'parquet' or 'arrow' (Arrow IPC file, also known as Feather v2). By default it is taken
+      from the extension of `path` (.parquet / .pq, or .arrow / .feather / .ipc).
+
+    Returns:
+    - str: The path of the written file, or None if `data` held no chunks.
+
+    Notes:
+    - Requires pyarrow (`pip install orange2df2excel[columnar]`).
+    - Arrow IPC files are uncompressed and can be memory-mapped by `read_columnar`; Parquet files are smaller.
+    """
+    chunks = [data] if isinstance(data, pd.DataFrame) else data
+    written = 0
+    with _ColumnarWriter(path, file_format) as writer:
+        for chunk in chunks:
+            with _stage('write_rows', file=path):
+                writer.write(chunk)
+            _count('rows', len(chunk), file=path)
+            written += 1
+    if not written:
+        logger.warning("No data to write to %s", path)
+        return None
+    return path
+
+@_instrumented
+def read_columnar(path, columns=None, file_format=None):
+    """
+    Read a Parquet or Arrow IPC file written by `write_columnar` into a DataFrame, memory-mapping the file.
+
+    Parameters:
+    - path: str - Path of the file.
+    - columns: list - Names of the columns to load. Only these columns are read from disk. Default is all columns.
+    - file_format: str - 'parquet' or 'arrow'. By default it is taken from the extension of `path`.
+
+    Returns:
+    - pandas.DataFrame: The data.
+    """
+    pa = _import_pyarrow()
+    with _stage('load', file=path):
+        if _columnar_format(path, file_format) == 'parquet':
+            import pyarrow.parquet as pq
+            df = pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+        else:
+            with pa.memory_map(str(path), 'r') as source:
+                table = pa.ipc.open_file(source).read_all()
+                if columns is not None:
+                    table = table.select(columns)
+                df = table.to_pandas()
+    _count('rows', len(df), file=path)
+    return df
@@ -0,0 +1,942 @@
+"""Encryption helpers: key derivation, value/column/JSON/photo/file encryption and password hashing.
+
+Only `cryptography` is imported up front; pandas, numpy, pycryptodome and bcrypt are imported by the functions
+that need them, so a worker that only decrypts values starts quickly.
+"""
+from datetime import date, datetime
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.backends import default_backend
+import json
+import base64
+import os
+import threading
+import struct
+import time
+import hashlib
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import OrderedDict
+
+from .metrics import _instrumented, _stage, _count
+
+logger = logging.getLogger(__name__)
+
+@_instrumented
+def gen_encryption_key(password):
+    """
+    Generates an AES encryption key using a password and a random salt.
+
+    Parameters:
+        password (str): The password or passphrase used for key derivation.
+
+    Returns:
+        str: A formatted string showing the derived key and salt.
+    """
+    from Crypto.Random import get_random_bytes
+    from Crypto.Protocol.KDF import PBKDF2
+
+    salt = get_random_bytes(32)
+    key = PBKDF2(password, salt, dkLen=32, count=1000000)
+    formatted = f"Key: {key}\nSalt: {salt}"
+    return formatted
+
+ENVELOPE_VERSION = 1
+_ENVELOPE_HEADER = bytes([ENVELOPE_VERSION])
+_ENVELOPE_OVERHEAD = len(_ENVELOPE_HEADER) + 12 + 16
+
+def encrypt_photo_for_sql(photo_bytes, key, raw=False):
+    """
+    Encrypts photo bytes using AES-GCM encryption.
+
+    Args:
+        photo_bytes (bytes): The image in bytes.
+        key (bytes): 32-byte AES encryption key.
+        raw (bool): If True, return a binary envelope (version + IV + tag + ciphertext) for a BLOB column,
+            which is a third smaller than the base64 text. Default is False.
+
+    Returns:
+        str or bytes: Base64 encoded encrypted data (IV + tag + ciphertext), or the binary envelope if `raw` is True.
+    """
+    if raw:
+        return _seal(photo_bytes, key)
+    return _encrypt_photo(photo_bytes, key)
+
+def _encrypt_photo(photo_bytes, key):
+    """ Base64 format of `encrypt_photo_for_sql`: IV + tag + ciphertext """
+    iv = os.urandom(12)
+    cipher = Cipher(algorithms.AES(key), modes.GCM(iv), backend=default_backend())
+    encryptor = cipher.encryptor()
+    encrypted_photo = encryptor.update(photo_bytes) + encryptor.finalize()
+    encrypted_data = iv + encryptor.tag + encrypted_photo
+    return base64.b64encode(encrypted_data).decode('utf-8')
+
+def decrypt_photo_for_sql(encrypted_base64, key):
+    """
+    Decrypts AES-GCM encrypted photo from the database.
+
+    Args:
+        encrypted_base64 (str or bytes): Base64 encoded encrypted data (IV + tag + ciphertext),
+            or a binary envelope from `encrypt_photo_for_sql(..., raw=True)`.
+        key (bytes): 32-byte AES decryption key.
+
+    Returns:
+        bytes: Decrypted photo bytes.
+    """
+    if _is_envelope(encrypted_base64):
+        return _open_envelope(encrypted_base64, key)
+    encrypted_bytes = base64.b64decode(encrypted_base64)
+    iv = encrypted_bytes[:12]
+    tag = encrypted_bytes[12:28]
+    ciphertext = encrypted_bytes[28:]
+    cipher = Cipher(algorithms.AES(key), modes.GCM(iv, tag), backend=default_backend())
+    decryptor = cipher.decryptor()
+    return decryptor.update(ciphertext) + decryptor.finalize()
+
+def json_serializable(obj):
+    """ Convert non-serializable types (e.g., date, datetime) to string """
+    if isinstance(obj, (date, datetime)):
+        return obj.isoformat()  # Convert date to "YYYY-MM-DD" or "YYYY-MM-DDTHH:MM:SS"
+    raise TypeError(f"Type {type(obj)} not serializable")
+
+def encrypt_json_data(data, key, raw=False):
+    """
+    Encrypts JSON data using AES-256-GCM.
+    Returns base64-encoded ciphertext, IV, and authentication tag,
+    or with `raw=True` one binary envelope (version + IV + tag + ciphertext) for a BLOB column.
+    """
+    # Convert JSON data to bytes (handle dates correctly)
+    json_data = json.dumps(data, default=json_serializable).encode()
+    if raw:
+        return _seal(json_data, key)
+
+    iv = os.urandom(12)  # 12-byte IV for AES-GCM
+    cipher = Cipher(algorithms.AES(key), modes.GCM(iv), backend=default_backend())
+    encryptor = cipher.encryptor()
+
+    # Encrypt the data
+    ciphertext = encryptor.update(json_data) + encryptor.finalize()
+
+    # Return Base64-encoded values
+    return {
+        "iv": base64.b64encode(iv).decode(),
+        "ciphertext": base64.b64encode(ciphertext).decode(),
+        "tag": base64.b64encode(encryptor.tag).decode()
+    }
+
+def decrypt_json_data(encrypted_data, key):
+    """
+    Decrypts AES-256-GCM encrypted JSON data.
+    Expects a dictionary with base64-encoded IV, ciphertext, and tag (or that dictionary as a JSON string),
+    or a binary envelope from `encrypt_json_data(..., raw=True)`.
+    Returns the decrypted JSON object.
+    """
+    try:
+        if isinstance(encrypted_data, (bytes, bytearray, memoryview)):
+            return json.loads(_open_envelope(encrypted_data, key).decode())
+        if isinstance(encrypted_data, str):
+            encrypted_data = json.loads(encrypted_data)
+
+        # Decode Base64 values
+        iv = base64.b64decode(encrypted_data["iv"])
+        ciphertext = base64.b64decode(encrypted_data["ciphertext"])
+        tag = base64.b64decode(encrypted_data["tag"])
+
+        # Create AES-GCM cipher
+        cipher = Cipher(algorithms.AES(key), modes.GCM(iv, tag), backend=default_backend())
+        decryptor = cipher.decryptor()
+
+        # Decrypt the data
+        decrypted_data = decryptor.update(ciphertext) + decryptor.finalize()
+
+        # Convert bytes back to JSON
+        return json.loads(decrypted_data.decode())
+    
+    except Exception:
+        logger.exception("Decryption error")
+        return None
+
+def _seal(plaintext, key):
+    """ AES-GCM encrypt into a binary envelope: version byte + 12-byte IV + 16-byte tag + ciphertext """
+    iv = os.urandom(12)
+    encryptor = Cipher(algorithms.AES(key), modes.GCM(iv), backend=default_backend()).encryptor()
+    # The version byte is authenticated, so it cannot be changed without failing decryption
+    encryptor.authenticate_additional_data(_ENVELOPE_HEADER)
+    ciphertext = encryptor.update(plaintext) + encryptor.finalize()
+    return _ENVELOPE_HEADER + iv + encryptor.tag + ciphertext
+
+def _is_envelope(data):
+    """ True for a binary envelope; base64 text (str, or bytes read from a text column) never starts with the version byte """
+    return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:1]) == _ENVELOPE_HEADER
+
+def _open_envelope(envelope, key):
+    """ Decrypt a binary envelope made by `_seal` """
+    envelope = bytes(envelope)
+    if envelope[:1] != _ENVELOPE_HEADER:
+        raise ValueError("Unsupported encrypted envelope version.")
+    if len(envelope) < _ENVELOPE_OVERHEAD:
+        raise ValueError("Encrypted envelope is truncated.")
+    iv = envelope[1:13]
+    tag = envelope[13:29]
+    decryptor = Cipher(algorithms.AES(key), modes.GCM(iv, tag), backend=default_backend()).decryptor()
+    decryptor.authenticate_additional_data(envelope[:1])
+    return decryptor.update(envelope[29:]) + decryptor.finalize()
+
+@_instrumented
+def encrypt_to_sql(connection, query, rows, key, columns, raw=True, batch_size=500):
+    """
+    Encrypts photos or JSON records and inserts them into a database in batched transactions.
+
+    Rows are read from `rows` in batches of `batch_size`; each batch is encrypted, written with one
+    `cursor.executemany(query, batch)` call and committed, so a generator of rows is never held in memory at once.
+
+    Parameters:
+        connection: An open DB-API connection (e.g. `sqlite3.connect(...)`, psycopg, pyodbc).
+        query (str): The INSERT statement, with placeholders in the driver's parameter style,
+            e.g. "INSERT INTO photos (submission_id, photo) VALUES (?, ?)" for SQLite.
+        rows (iterable): Parameter rows for `query`, as tuples/lists (positional placeholders) or dicts (named placeholders).
+        key (bytes): 32-byte AES encryption key.
+        columns (list): Positions (or dict keys) of the values to encrypt in every row. Bytes values are encrypted
+            as photos (`encrypt_photo_for_sql`), anything else as JSON (`encrypt_json_data`). None is left as is.
+        raw (bool): If True (default), store binary envelopes (for BLOB columns); if False, store base64 text
+            (JSON records as the JSON text of the `encrypt_json_data` dictionary).
+        batch_size (int): Number of rows per `executemany` call and transaction. Default is 500.
+
+    Returns:
+        int: The number of rows inserted.
+
+    Notes:
+        If a batch fails, its transaction is rolled back and the exception is raised; earlier batches stay committed.
+    """
+    rows = iter(rows)
+    inserted = 0
+    cursor = connection.cursor()
+    try:
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            with _stage('encrypt', rows=len(batch)):
+                batch = [_encrypt_row(row, key, columns, raw) for row in batch]
+            try:
+                with _stage('write_rows', rows=len(batch)):
+                    cursor.executemany(query, batch)
+                    connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            inserted += len(batch)
+            _count('rows', len(batch))
+            logger.debug("%d encrypted rows inserted", inserted)
+    finally:
+        cursor.close()
+    logger.info("%d encrypted rows inserted", inserted)
+    return inserted
+
+def _encrypt_row(row, key, columns, raw):
+    """ Copy of a parameter row (sequence or mapping) with the values at `columns` encrypted """
+    row = dict(row) if isinstance(row, dict) else list(row)
+    for column in columns:
+        value = row[column]
+        if value is None:
+            continue
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            _count('bytes', len(value))
+            row[column] = _seal(bytes(value), key) if raw else _encrypt_photo(bytes(value), key)
+        elif raw:
+            row[column] = encrypt_json_data(value, key, raw=True)
+        else:
+            row[column] = json.dumps(encrypt_json_data(value, key))
+    return row
+
+def encrypt_value(value, key):
+    """
+    Encrypts a given value (string or number) using AES encryption in CBC mode with a random IV.
+    """
+    value = str(value).encode()
+    iv = os.urandom(16)
+    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
+    encryptor = cipher.encryptor()
+    padder = padding.PKCS7(algorithms.AES.block_size).padder()
+    padded_value = padder.update(value) + padder.finalize()
+    ciphertext = encryptor.update(padded_value) + encryptor.finalize()
+    encrypted_value = base64.b64encode(iv + ciphertext).decode('utf-8')
+    
+    return encrypted_value
+
+def decrypt_value(encrypted_data, key):
+    """
+    Decrypts a given encrypted value using AES encryption in CBC mode.
+    """
+    encrypted_data_bytes = base64.b64decode(encrypted_data)
+    iv = encrypted_data_bytes[:16]
+    ciphertext = encrypted_data_bytes[16:]
+    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
+    decryptor = cipher.decryptor()
+    decrypted_padded_value = decryptor.update(ciphertext) + decryptor.finalize()
+    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+    decrypted_value = unpadder.update(decrypted_padded_value) + unpadder.finalize()
+    
+    return decrypted_value.decode('utf-8')
+
+@_instrumented
+def encrypt_columns(df, columns, key, max_workers=None, batch_size=50000):
+    """
+    Encrypts whole DataFrame columns with AES in CBC mode, batch by batch.
+
+    The output of every cell is byte-compatible with `encrypt_value` (base64 of IV + ciphertext, random IV per value)
+    and can be decrypted with `decrypt_value` or `decrypt_columns`. Instead of building a cipher per value, each batch
+    is encrypted block position by block position with a single AES call, chaining the blocks with numpy.
+
+    Parameters:
+        df (pandas.DataFrame): The data to encrypt.
+        columns (list): Names of the columns to encrypt. Values are converted with `str()` like in `encrypt_value`;
+            missing values stay missing.
+        key (bytes): The 32-byte AES encryption key.
+        max_workers (int): If set, spread the batches over a process pool with this many workers.
+        batch_size (int): Number of values encrypted per batch. Default is 50000.
+
+    Returns:
+        pandas.DataFrame: A copy of `df` with the given columns encrypted.
+    """
+    return _transform_columns(df, columns, key, _encrypt_batch, max_workers, batch_size, 'encrypt')
+
+@_instrumented
+def decrypt_columns(df, columns, key, max_workers=None, batch_size=50000):
+    """
+    Decrypts DataFrame columns produced by `encrypt_columns` or `encrypt_value`, batch by batch.
+
+    Parameters:
+        df (pandas.DataFrame): The data to decrypt.
+        columns (list): Names of the encrypted columns. Missing values stay missing.
+        key (bytes): The 32-byte AES decryption key.
+        max_workers (int): If set, spread the batches over a process pool with this many workers.
+        batch_size (int): Number of values decrypted per batch. Default is 50000.
+
+    Returns:
+        pandas.DataFrame: A copy of `df` with the given columns decrypted to strings.
+    """
+    return _transform_columns(df, columns, key, _decrypt_batch, max_workers, batch_size, 'decrypt')
+
+def _transform_columns(df, columns, key, batch_function, max_workers, batch_size, stage):
+    """ Apply a batch (list -> list) function to the non-null values of some columns, optionally on a process pool """
+    import pandas as pd
+
+    result = df.copy()
+    executor = ProcessPoolExecutor(max_workers=max_workers) if max_workers else None
+    try:
+        for column in columns:
+            values = result[column]
+            mask = values.notna()
+            items = values[mask].tolist()
+            batches = [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+            with _stage(stage, column=column):
+                if executor is not None:
+                    transformed = executor.map(batch_function, batches, [key] * len(batches))
+                else:
+                    transformed = (batch_function(batch, key) for batch in batches)
+                output = pd.Series(None, index=values.index, dtype=object)
+                output[mask] = [value for batch in transformed for value in batch]
+            _count('rows', len(items), column=column)
+            result[column] = output
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return result
+
+def _group_by_length(blobs):
+    """ Group positions of byte strings by their length so each group can be processed as a 2D array """
+    groups = {}
+    for position, blob in enumerate(blobs):
+        groups.setdefault(len(blob), []).append(position)
+    return groups
+
+def _encrypt_batch(values, key):
+    """ Vectorized equivalent of `[encrypt_value(value, key) for value in values]` """
+    import numpy as np
+
+    ecb = Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend())
+    padded = []
+    for value in values:
+        data = str(value).encode()
+        pad_length = 16 - len(data) % 16
+        padded.append(data + bytes([pad_length]) * pad_length)
+
+    output = [None] * len(values)
+    for length, positions in _group_by_length(padded).items():
+        rows = len(positions)
+        plain = np.frombuffer(b''.join(padded[position] for position in positions), dtype=np.uint8).reshape(rows, length)
+        previous = np.frombuffer(os.urandom(16 * rows), dtype=np.uint8).reshape(rows, 16)
+        blocks = [previous]
+        encryptor = ecb.encryptor()
+        for offset in range(0, length, 16):
+            previous = np.frombuffer(
+                encryptor.update((plain[:, offset:offset + 16] ^ previous).tobytes()), dtype=np.uint8
+            ).reshape(rows, 16)
+            blocks.append(previous)
+        encrypted = np.hstack(blocks)
+        for row, position in enumerate(positions):
+            output[position] = base64.b64encode(encrypted[row].tobytes()).decode('utf-8')
+    return output
+
+def _decrypt_batch(values, key):
+    """ Vectorized equivalent of `[decrypt_value(value, key) for value in values]` """
+    import numpy as np
+
+    ecb = Cipher(algorithms.AES(key), modes.ECB(), backend=default_backend())
+    raw = [base64.b64decode(value) for value in values]
+
+    output = [None] * len(values)
+    for length, positions in _group_by_length(raw).items():
+        if length < 32 or length % 16:
+            raise ValueError("Invalid encrypted value length.")
+        rows = len(positions)
+        data = np.frombuffer(b''.join(raw[position] for position in positions), dtype=np.uint8).reshape(rows, length)
+        decrypted = np.frombuffer(ecb.decryptor().update(data[:, 16:].tobytes()), dtype=np.uint8).reshape(rows, length - 16)
+        plain = decrypted ^ data[:, :-16]
+        pad_lengths = plain[:, -1].astype(np.int64)
+        pad_columns = np.arange(length - 16)[::-1] + 1
+        in_padding = pad_columns[np.newaxis, :] <= pad_lengths[:, np.newaxis]
+        if ((pad_lengths < 1) | (pad_lengths > 16)).any() or (in_padding & (plain != pad_lengths[:, np.newaxis])).any():
+            raise ValueError("Invalid padding bytes.")
+        for row, position in enumerate(positions):
+            output[position] = plain[row, :length - 16 - pad_lengths[row]].tobytes().decode('utf-8')
+    return output
+
+@_instrumented
+def rederive_key(password, salt):
+    """
+    Re-derives the AES encryption key using the original password and salt.
+
+    Parameters:
+        password (str): The original password or passphrase used for key derivation.
+        salt (bytes): The original salt used during the initial key derivation.
+
+    Returns:
+        bytes: The re-derived 32-byte encryption key.
+    """
+    from Crypto.Protocol.KDF import PBKDF2
+
+    key = PBKDF2(password, salt, dkLen=32, count=1000000)
+    return key
+
+KEY_CACHE_TTL = 3600
+KEY_CACHE_SIZE = 16
+
+_KEY_CACHE = OrderedDict()
+_KEY_CACHE_LOCK = threading.Lock()
+
+def _zeroize(buffer):
+    """ Overwrite a mutable key buffer in place """
+    buffer[:] = bytes(len(buffer))
+
+def _cached_key(password, salt, ttl=None):
+    """
+    Return a copy of the key for (password, salt), deriving it with `rederive_key` only on a cache miss.
+    Cached keys are stored as bytearrays keyed by a SHA-256 digest of the password, evicted after `ttl`
+    seconds or when the cache is full, and zeroized on eviction.
+    """
+    password_bytes = password.encode() if isinstance(password, str) else bytes(password)
+    cache_key = (hashlib.sha256(password_bytes).digest(), bytes(salt))
+    now = time.monotonic()
+    with _KEY_CACHE_LOCK:
+        _evict_keys(now)
+        entry = _KEY_CACHE.get(cache_key)
+        if entry is not None:
+            _KEY_CACHE.move_to_end(cache_key)
+            return bytearray(entry[0])
+
+    key = bytearray(rederive_key(password, salt))
+    expires_at = now + (KEY_CACHE_TTL if ttl is None else ttl)
+    with _KEY_CACHE_LOCK:
+        previous = _KEY_CACHE.pop(cache_key, None)
+        if previous is not None:
+            _zeroize(previous[0])
+        _KEY_CACHE[cache_key] = (bytearray(key), expires_at)
+        while len(_KEY_CACHE) > KEY_CACHE_SIZE:
+            _zeroize(_KEY_CACHE.popitem(last=False)[1][0])
+    return key
+
+def _evict_keys(now):
+    """ Drop and zeroize expired cache entries (the cache lock must be held) """
+    for cache_key in [cache_key for cache_key, (_, expires_at) in _KEY_CACHE.items() if expires_at <= now]:
+        _zeroize(_KEY_CACHE.pop(cache_key)[0])
+
+@_instrumented
+def clear_key_cache():
+    """
+    Zeroizes and removes every key held by the in-process key cache used by `KeySession`.
+    """
+    with _KEY_CACHE_LOCK:
+        while _KEY_CACHE:
+            _zeroize(_KEY_CACHE.popitem()[1][0])
+
+class KeySession:
+    """
+    Derives the AES key for a password and salt once and exposes the encryption helpers as bound methods.
+
+    Keys are kept in an in-process cache keyed by (password digest, salt), so creating another session for the
+    same password and salt in a long-running process does not run PBKDF2 again. Cached keys expire after `ttl`
+    seconds (default `KEY_CACHE_TTL`) or when more than `KEY_CACHE_SIZE` keys are cached, and are zeroized when
+    evicted. The session's own copy of the key is zeroized by `close()` or at the end of a `with` block.
+
+    Parameters:
+        password (str): The original password or passphrase used for key derivation.
+        salt (bytes): The original salt used during the initial key derivation.
+        ttl (int): Lifetime of the cached key in seconds. Defaults to `KEY_CACHE_TTL`.
+
+    Example:
+        with KeySession(password, salt) as session:
+            token = session.encrypt_value("sensitive")
+    """
+
+    def __init__(self, password, salt, ttl=None):
+        self.key = _cached_key(password, salt, ttl)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """ Zeroize this session's copy of the key; the session cannot be used afterwards """
+        _zeroize(self.key)
+        self.key = None
+
+    def encrypt_value(self, value):
+        return encrypt_value(value, self.key)
+
+    def decrypt_value(self, encrypted_data):
+        return decrypt_value(encrypted_data, self.key)
+
+    def encrypt_columns(self, df, columns, **kwargs):
+        return encrypt_columns(df, columns, self.key, **kwargs)
+
+    def decrypt_columns(self, df, columns, **kwargs):
+        return decrypt_columns(df, columns, self.key, **kwargs)
+
+    def encrypt_json_data(self, data, raw=False):
+        return encrypt_json_data(data, self.key, raw)
+
+    def decrypt_json_data(self, encrypted_data):
+        return decrypt_json_data(encrypted_data, self.key)
+
+    def encrypt_photo_for_sql(self, photo_bytes, raw=False):
+        return encrypt_photo_for_sql(photo_bytes, self.key, raw)
+
+    def decrypt_photo_for_sql(self, encrypted_base64):
+        return decrypt_photo_for_sql(encrypted_base64, self.key)
+
+    def encrypt_to_sql(self, connection, query, rows, columns, **kwargs):
+        return encrypt_to_sql(connection, query, rows, self.key, columns, **kwargs)
+
+    def encrypt_file(self, input_file_path, output_file_path):
+        return encrypt_file(input_file_path, output_file_path, self.key)
+
+    def decrypt_file(self, encrypted_file_path, output_file_path):
+        return decrypt_file(encrypted_file_path, output_file_path, self.key)
+
+@_instrumented
+def encrypt_file(input_file_path, output_file_path, key):
+    """
+    Encrypts the contents of a specified file using AES encryption in CBC mode with PKCS7 padding.
+
+    Parameters:
+        input_file_path (str): The path to the file that needs to be encrypted.
+        output_file_path (str): The path where the encrypted file will be saved. (.en extension)
+        key (bytes): The 32-byte AES encryption key.
+
+    Returns:
+        None: This function does not return a value but saves the encrypted file at the specified path.
+
+    Notes:
+        - The function generates a random 16-byte initialization vector (IV) for each encryption operation.
+        - The IV is written at the beginning of the output file and is required for decryption.
+        - The file is read and encrypted in chunks to optimize memory usage.
+        - For large files prefer `encrypt_file_segmented`, which is authenticated, multi-core and supports random access.
+    """
+    iv = os.urandom(16)
+    cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
+    encryptor = cipher.encryptor()
+    padder = padding.PKCS7(algorithms.AES.block_size).padder()
+    with _stage('encrypt', file=input_file_path), open(input_file_path, 'rb') as input_file, open(output_file_path, 'wb') as output_file:
+        output_file.write(iv)
+        while True:
+            chunk = input_file.read(FILE_CHUNK_SIZE)
+            if len(chunk) == 0:
+                break
+            padded_chunk = padder.update(chunk)
+            encrypted_chunk = encryptor.update(padded_chunk)
+            output_file.write(encrypted_chunk)
+        padded_chunk = padder.finalize()
+        encrypted_chunk = encryptor.update(padded_chunk) + encryptor.finalize()
+        output_file.write(encrypted_chunk)
+    _count('bytes', os.path.getsize(input_file_path))
+    logger.info("File '%s' encrypted successfully and saved as '%s'", input_file_path, output_file_path)
+
+@_instrumented
+def decrypt_file(encrypted_file_path, output_file_path, key):
+    """
+    Decrypts a file that was encrypted using AES encryption in CBC mode with PKCS7 padding.
+
+    Parameters:
+        encrypted_file_path (str): The path to the encrypted file that needs to be decrypted.
+        output_file_path (str): The path where the decrypted file will be saved. (.en extension)
+        key (bytes): The 32-byte AES decryption key.
+
+    Returns:
+        None: This function does not return a value but saves the decrypted file at the specified path.
+
+    Notes:
+        - The function reads the 16-byte initialization vector (IV) from the beginning of the encrypted file.
+        - If the IV is missing or invalid, a ValueError will be raised.
+        - After decryption, PKCS7 padding is removed to restore the original content.
+        - The file is read and decrypted in chunks for efficient memory usage.
+        - Files written by `encrypt_file_segmented` are recognised by their header and decrypted with `decrypt_file_segmented`.
+    """
+    if _is_segmented_file(encrypted_file_path):
+        decrypt_file_segmented(encrypted_file_path, output_file_path, key)
+        return
+
+    with _stage('decrypt', file=encrypted_file_path), open(encrypted_file_path, 'rb') as encrypted_file, open(output_file_path, 'wb') as output_file:
+        iv = encrypted_file.read(16)
+        if len(iv) != 16:
+            raise ValueError("Invalid IV length, file may not be encrypted correctly.")
+        cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
+        decryptor = cipher.decryptor()
+        unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+        while True:
+            chunk = encrypted_file.read(FILE_CHUNK_SIZE)
+            if len(chunk) == 0:
+                break
+            # The unpadder holds back the last block until finalize(), so the padding is
+            # removed correctly whatever the ciphertext length is
+            output_file.write(unpadder.update(decryptor.update(chunk)))
+        output_file.write(unpadder.update(decryptor.finalize()) + unpadder.finalize())
+    _count('bytes', os.path.getsize(output_file_path))
+    logger.info("File '%s' decrypted successfully and saved as '%s'", encrypted_file_path, output_file_path)
+
+FILE_CHUNK_SIZE = 1024 * 1024
+
+SEGMENTED_FILE_MAGIC = b"O2DXSEG1"
+SEGMENTED_FILE_VERSION = 1
+SEGMENT_SIZE = 4 * 1024 * 1024
+_SEGMENT_HEADER = struct.Struct('>8sB3xI8sQ')  # magic, version, segment size, nonce prefix, plaintext size
+_GCM_TAG_SIZE = 16
+
+@_instrumented
+def encrypt_file_segmented(input_file_path, output_file_path, key, segment_size=SEGMENT_SIZE, max_workers=None):
+    """
+    Encrypts a file in independent AES-256-GCM segments, optionally on several cores.
+
+    File layout:
+        - A 32-byte header: magic, format version, segment size, random nonce prefix and plaintext size.
+        - One record per segment: ciphertext followed by its 16-byte GCM tag.
+          Segment i is encrypted with the nonce (nonce prefix + i) and the header as associated data,
+          so segments cannot be reordered, swapped between files or truncated without detection.
+
+    Parameters:
+        input_file_path (str): The path to the file that needs to be encrypted.
+        output_file_path (str): The path where the encrypted file will be saved.
+        key (bytes): The 32-byte AES encryption key.
+        segment_size (int): Plaintext bytes per segment. Default is 4 MiB.
+        max_workers (int): If set, segments are encrypted by this many worker processes, each reading and writing
+            its own segments at their fixed offsets.
+
+    Returns:
+        None: This function does not return a value but saves the encrypted file at the specified path.
+    """
+    plaintext_size = os.path.getsize(input_file_path)
+    header = _SEGMENT_HEADER.pack(SEGMENTED_FILE_MAGIC, SEGMENTED_FILE_VERSION, segment_size, os.urandom(8), plaintext_size)
+    segment_count = _segment_count(plaintext_size, segment_size)
+    with open(output_file_path, 'wb') as output_file:
+        output_file.write(header)
+        output_file.truncate(len(header) + plaintext_size + segment_count * _GCM_TAG_SIZE)
+
+    with _stage('encrypt', file=input_file_path, segments=segment_count):
+        _run_segments(_encrypt_segments, input_file_path, output_file_path, key, header, segment_count, max_workers)
+    _count('bytes', plaintext_size)
+    logger.info("File '%s' encrypted successfully and saved as '%s'", input_file_path, output_file_path)
+
+@_instrumented
+def decrypt_file_segmented(encrypted_file_path, output_file_path, key, max_workers=None):
+    """
+    Decrypts a file written by `encrypt_file_segmented`, optionally on several cores.
+
+    Parameters:
+        encrypted_file_path (str): The path to the encrypted file.
+        output_file_path (str): The path where the decrypted file will be saved.
+        key (bytes): The 32-byte AES decryption key.
+        max_workers (int): If set, segments are decrypted by this many worker processes.
+
+    Returns:
+        None: This function does not return a value but saves the decrypted file at the specified path.
+
+    Notes:
+        - A `cryptography.exceptions.InvalidTag` is raised if any segment was modified or the key is wrong.
+    """
+    header, segment_size, plaintext_size = _read_segment_header(encrypted_file_path)
+    segment_count = _segment_count(plaintext_size, segment_size)
+    with open(output_file_path, 'wb') as output_file:
+        output_file.truncate(plaintext_size)
+
+    with _stage('decrypt', file=encrypted_file_path, segments=segment_count):
+        _run_segments(_decrypt_segments, encrypted_file_path, output_file_path, key, header, segment_count, max_workers)
+    _count('bytes', plaintext_size)
+    logger.info("File '%s' decrypted successfully and saved as '%s'", encrypted_file_path, output_file_path)
+
+@_instrumented
+def decrypt_file_range(encrypted_file_path, key, offset, length):
+    """
+    Decrypts only the bytes [offset, offset + length) of a file written by `encrypt_file_segmented`.
+    Only the segments overlapping the range are read and authenticated.
+
+    Parameters:
+        encrypted_file_path (str): The path to the encrypted file.
+        key (bytes): The 32-byte AES decryption key.
+        offset (int): Position of the first plaintext byte to return.
+        length (int): Number of plaintext bytes to return (fewer if the range goes past the end of the file).
+
+    Returns:
+        bytes: The decrypted bytes.
+    """
+    if offset < 0 or length < 0:
+        raise ValueError("offset and length must not be negative.")
+    header, segment_size, plaintext_size = _read_segment_header(encrypted_file_path)
+    end = min(offset + length, plaintext_size)
+    if offset >= end:
+        return b''
+    aesgcm = AESGCM(bytes(key))
+    parts = []
+    with open(encrypted_file_path, 'rb') as encrypted_file:
+        for index in range(offset // segment_size, (end - 1) // segment_size + 1):
+            plaintext = _decrypt_segment(aesgcm, encrypted_file, header, segment_size, plaintext_size, index)
+            segment_start = index * segment_size
+            parts.append(plaintext[max(offset - segment_start, 0):end - segment_start])
+    _count('bytes', end - offset)
+    return b''.join(parts)
+
+def _is_segmented_file(path):
+    """ True if the file starts with the `encrypt_file_segmented` magic bytes """
+    with open(path, 'rb') as file:
+        return file.read(len(SEGMENTED_FILE_MAGIC)) == SEGMENTED_FILE_MAGIC
+
+def _read_segment_header(path):
+    """ Read and validate the header of a segmented file; returns (header bytes, segment size, plaintext size) """
+    with open(path, 'rb') as file:
+        header = file.read(_SEGMENT_HEADER.size)
+    if len(header) != _SEGMENT_HEADER.size:
+        raise ValueError("File is too short to be a segmented encrypted file.")
+    magic, version, segment_size, _, plaintext_size = _SEGMENT_HEADER.unpack(header)
+    if magic != SEGMENTED_FILE_MAGIC or version != SEGMENTED_FILE_VERSION or segment_size <= 0:
+        raise ValueError("Not a segmented encrypted file or unsupported version.")
+    return header, segment_size, plaintext_size
+
+def _segment_count(plaintext_size, segment_size):
+    """ Number of segments for a plaintext size; an empty file still has one (empty, authenticated) segment """
+    return max(1, -(-plaintext_size // segment_size))
+
+def _segment_nonce(header, index):
+    """ 12-byte GCM nonce of a segment: the file's random 8-byte prefix followed by the segment index """
+    return header[16:24] + struct.pack('>I', index)
+
+def _decrypt_segment(aesgcm, encrypted_file, header, segment_size, plaintext_size, index):
+    """ Read and decrypt one segment from an open segmented file """
+    segment_length = min(segment_size, plaintext_size - index * segment_size)
+    encrypted_file.seek(_SEGMENT_HEADER.size + index * (segment_size + _GCM_TAG_SIZE))
+    record = encrypted_file.read(segment_length + _GCM_TAG_SIZE)
+    return aesgcm.decrypt(_segment_nonce(header, index), record, header)
+
+def _encrypt_segments(input_file_path, output_file_path, key, header, indices):
+    """ Worker: encrypt the given segments from the input file into their slots of the pre-sized output file """
+    _, _, segment_size, _, _ = _SEGMENT_HEADER.unpack(header)
+    aesgcm = AESGCM(bytes(key))
+    with open(input_file_path, 'rb') as input_file, open(output_file_path, 'r+b') as output_file:
+        for index in indices:
+            input_file.seek(index * segment_size)
+            plaintext = input_file.read(segment_size)
+            output_file.seek(_SEGMENT_HEADER.size + index * (segment_size + _GCM_TAG_SIZE))
+            output_file.write(aesgcm.encrypt(_segment_nonce(header, index), plaintext, header))
+
+def _decrypt_segments(encrypted_file_path, output_file_path, key, header, indices):
+    """ Worker: decrypt the given segments into their slots of the pre-sized output file """
+    _, _, segment_size, _, plaintext_size = _SEGMENT_HEADER.unpack(header)
+    aesgcm = AESGCM(bytes(key))
+    with open(encrypted_file_path, 'rb') as encrypted_file, open(output_file_path, 'r+b') as output_file:
+        for index in indices:
+            plaintext = _decrypt_segment(aesgcm, encrypted_file, header, segment_size, plaintext_size, index)
+            output_file.seek(index * segment_size)
+            output_file.write(plaintext)
+
+def _run_segments(worker, source_path, target_path, key, header, segment_count, max_workers):
+    """ Run a segment worker over all segments, in-process or split in contiguous runs over a process pool """
+    if not max_workers or max_workers <= 1 or segment_count == 1:
+        worker(source_path, target_path, key, header, range(segment_count))
+        return
+    run_length = -(-segment_count // max_workers)
+    runs = [range(start, min(start + run_length, segment_count)) for start in range(0, segment_count, run_length)]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for future in [executor.submit(worker, source_path, target_path, bytes(key), header, run) for run in runs]:
+            future.result()
+
+BCRYPT_ROUNDS = 15
+
+def hash_password(password, rounds=BCRYPT_ROUNDS):
+    """
+    Hashes the provided password using bcrypt and returns the resulting hash as a string.
+
+    This function generates a secure hash for the input password by:
+    - Generating a salt with a cost factor of `rounds` (15 by default), enhancing the security level of the hash.
+    - Hashing the password in combination with the generated salt to ensure unique hashes for identical passwords.
+
+    Parameters:
+    password (str): The plain text password to be hashed.
+    rounds (int): The bcrypt cost factor (4-31). Every extra round doubles the hashing time;
+        see `calibrate_bcrypt_rounds`. Default is 15.
+
+    Returns:
+    str: The bcrypt hash of the password, encoded as a string to facilitate storage or comparison.
+    """
+    return _hash_one(password, rounds)
+
+def verify_password(password, hashed):
+    """
+    Checks a plain text password against a bcrypt hash made by `hash_password`.
+
+    The cost factor is read from the hash, so hashes made with different `rounds` can be verified alike.
+
+    Parameters:
+    password (str): The plain text password to check.
+    hashed (str or bytes): The stored bcrypt hash.
+
+    Returns:
+    bool: True if the password matches. False if it does not, or if `hashed` is not a valid bcrypt hash.
+    """
+    return _check_one(password, hashed)
+
+@_instrumented
+def hash_passwords(passwords, rounds=BCRYPT_ROUNDS, max_workers=None, executor='process', progress=None):
+    """
+    Hashes many passwords with bcrypt, spread over a pool of workers.
+
+    Parameters:
+    passwords (list or pandas.Series): Plain text passwords. Values that are not strings (None, NaN) are returned as None.
+    rounds (int): The bcrypt cost factor, as in `hash_password`. Default is 15.
+    max_workers (int): Number of passwords hashed at the same time. Defaults to the number of CPUs;
+        1 hashes in the calling thread.
+    executor (str): 'process' to hash in worker processes, or 'thread' to hash in threads. bcrypt releases the GIL
+        while hashing, so threads also use every core and avoid starting processes. Default is 'process'.
+    progress (callable): Called as `progress(done, total)` each time a password is finished.
+
+    Returns:
+    list: The bcrypt hashes as strings, in the order of `passwords`.
+    """
+    passwords = list(passwords)
+    return _run_bcrypt(_hash_one, [(password, rounds) for password in passwords],
+                       [isinstance(password, str) for password in passwords], max_workers, executor, progress, 'hash')
+
+@_instrumented
+def verify_passwords(passwords, hashes, max_workers=None, executor='process', progress=None):
+    """
+    Checks many passwords against their bcrypt hashes, spread over a pool of workers.
+
+    Parameters:
+    passwords (list or pandas.Series): Plain text passwords.
+    hashes (list or pandas.Series): The stored bcrypt hashes, one per password.
+    max_workers (int): Number of passwords checked at the same time, as in `hash_passwords`.
+    executor (str): 'process' or 'thread', as in `hash_passwords`. Default is 'process'.
+    progress (callable): Called as `progress(done, total)` each time a password is checked.
+
+    Returns:
+    list: One bool per password; pairs with a missing (non-string) password or hash are False.
+    """
+    passwords, hashes = list(passwords), list(hashes)
+    if len(passwords) != len(hashes):
+        raise ValueError("passwords and hashes must have the same length.")
+    pairs = list(zip(passwords, hashes))
+    results = _run_bcrypt(_check_one, pairs, [isinstance(password, str) and isinstance(hashed, (str, bytes)) for password, hashed in pairs],
+                          max_workers, executor, progress, 'verify')
+    return [bool(result) for result in results]
+
+@_instrumented
+def calibrate_bcrypt_rounds(target_seconds=0.25, min_rounds=10, max_rounds=31):
+    """
+    Picks the bcrypt cost factor for a target hashing time on the current machine.
+
+    Hashes a test password with `min_rounds`, then one more round at a time (each doubles the time) while the next
+    round is still expected to stay within `target_seconds`. The total calibration time is about twice the target.
+
+    Parameters:
+    target_seconds (float): Longest acceptable time to hash or verify one password. Default is 0.25.
+    min_rounds (int): Lowest cost factor returned, even if it is slower than the target. Default is 10.
+    max_rounds (int): Highest cost factor returned. Default is 31 (the bcrypt maximum).
+
+    Returns:
+    int: The cost factor to pass as `rounds` to `hash_password` or `hash_passwords`.
+    """
+    rounds = min_rounds
+    seconds = _time_bcrypt(rounds)
+    while rounds < max_rounds and seconds * 2 <= target_seconds:
+        rounds += 1
+        seconds = _time_bcrypt(rounds)
+    if seconds > target_seconds:
+        logger.warning("bcrypt with %d rounds takes %.2f s, over the %.2f s target", rounds, seconds, target_seconds)
+    logger.info("bcrypt cost factor %d takes %.3f s per password on this machine", rounds, seconds)
+    return rounds
+
+def _time_bcrypt(rounds):
+    """ Seconds taken to hash a test password with `rounds` """
+    start = time.perf_counter()
+    _hash_one('calibration password', rounds)
+    return time.perf_counter() - start
+
+def _hash_one(password, rounds):
+    """ Worker: bcrypt-hash one password. Module level so process pools can pickle it """
+    import bcrypt
+
+    salt = bcrypt.gensalt(rounds=rounds)
+    hashed = bcrypt.hashpw(password.encode(), salt)
+    return hashed.decode()
+
+def _check_one(password, hashed):
+    """ Worker: check one password against a bcrypt hash """
+    import bcrypt
+
+    if isinstance(hashed, str):
+        hashed = hashed.encode()
+    try:
+        return bcrypt.checkpw(password.encode(), hashed)
+    except ValueError:
+        logger.warning("Not a valid bcrypt hash")
+        return False
+
+def _run_bcrypt(worker, items, mask, max_workers, executor, progress, stage):
+    """ Apply `worker(*item)` to the items where `mask` is True, on a pool; the other results are None """
+    if executor not in ('thread', 'process'):
+        raise ValueError("executor must be 'thread' or 'process'.")
+    results = [None] * len(items)
+    positions = [position for position, keep in enumerate(mask) if keep]
+    total = len(positions)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    with _stage(stage, workers=max_workers):
+        if max_workers <= 1 or total <= 1:
+            for done, position in enumerate(positions, start=1):
+                results[position] = worker(*items[position])
+                if progress is not None:
+                    progress(done, total)
+        else:
+            pool_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+            with pool_class(max_workers=max_workers) as pool:
+                futures = {pool.submit(worker, *items[position]): position for position in positions}
+                for done, future in enumerate(as_completed(futures), start=1):
+                    results[futures[future]] = future.result()
+                    if progress is not None:
+                        progress(done, total)
+    _count('rows', total)
+    logger.info("%d passwords processed (%s) with %d workers", total, stage, max_workers)
+    return results
@@ -0,0 +1,994 @@
+"""Writing DataFrames to Excel: formatted tables, batches of sheets and chart dashboards."""
+from openpyxl import Workbook, load_workbook
+from openpyxl.worksheet.table import Table, TableStyleInfo
+from openpyxl.utils.dataframe import dataframe_to_rows
+from openpyxl.utils import get_column_letter
+import xlsxwriter
+import pandas as pd
+import os
+import posixpath
+import shutil
+import tempfile
+import zipfile
+import warnings
+import re
+import weakref
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from xml.sax.saxutils import escape, unescape
+
+from .metrics import _instrumented, _stage, _count
+from .columnar import _ColumnarWriter
+
+logger = logging.getLogger(__name__)
+
+# Size of an Excel worksheet; the first row of every sheet holds the header
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_COLUMNS = 16384
+
+@_instrumented
+def raw_data_to_excel(df, file_path, sheet_name, streaming=False, autofit=True, rows_per_sheet=None, columns_per_sheet=None):
+    """
+    Write a DataFrame to an Excel file in table format.
+    
+    Parameters:
+    - df: pandas.DataFrame or iterable of pandas.DataFrame - The data to write to Excel.
+      An iterable of DataFrame chunks (e.g. from `pd.read_csv(chunksize=...)`) is always written in streaming mode.
+    - file_path: str - Path to the Excel file.
+    - sheet_name: str - Name of the sheet to write data to.
+    - streaming: bool - If True, write rows with a write-only workbook so memory use stays constant
+      regardless of the number of rows. Default is False.
+    - autofit: bool or dict - True to size columns from the data, a dict of column widths
+      (e.g. from `compute_column_widths`) to use those widths, or False to leave widths untouched. Default is True.
+    - rows_per_sheet: int - Maximum number of data rows per sheet. Default is the Excel limit (1,048,575 plus the header).
+    - columns_per_sheet: int - Maximum number of columns per sheet. Default is the Excel limit (16,384).
+
+    Notes:
+    - Data that does not fit on one sheet is split over numbered sheets ("raw data", "raw data (2)", ...),
+      each with its own header and table. Numbered sheets left over from an earlier, larger export are removed.
+    """
+    if streaming or not isinstance(df, pd.DataFrame):
+        _raw_data_to_excel_streaming(df, file_path, sheet_name, autofit, rows_per_sheet, columns_per_sheet)
+        return
+
+    with _stage('load', file=file_path):
+        workbook = _open_workbook(file_path)
+    parts = _write_table_parts(workbook, sheet_name, df, autofit, "raw_data", rows_per_sheet, columns_per_sheet)
+    with _stage('save', file=file_path):
+        workbook.save(file_path)
+    logger.info("Sheet '%s' (%d rows, %d sheets) saved to %s", sheet_name, len(df), parts, file_path)
+
+@_instrumented
+def raw_data_to_excel_batch(sheets, file_path, autofit=True, rows_per_sheet=None, columns_per_sheet=None):
+    """
+    Write several DataFrames to one Excel file in table format with a single open/save cycle.
+
+    Parameters:
+    - sheets: dict - Mapping of sheet name to pandas.DataFrame. Existing sheets with the same names are replaced.
+    - file_path: str - Path to the Excel file.
+    - autofit: bool or dict - Column widths, with the same meaning as in `raw_data_to_excel`. Default is True.
+    - rows_per_sheet, columns_per_sheet: int - Sheet size limits, as in `raw_data_to_excel`.
+
+    Notes:
+    - Every table gets a unique `displayName` derived from its sheet name.
+    - DataFrames over the sheet size limits are split over numbered sheets, as in `raw_data_to_excel`.
+    """
+    with _stage('load', file=file_path):
+        workbook = _open_workbook(file_path)
+    for sheet_name, df in sheets.items():
+        _write_table_parts(workbook, sheet_name, df, autofit, _table_name_from_sheet(sheet_name), rows_per_sheet, columns_per_sheet)
+    with _stage('save', file=file_path):
+        workbook.save(file_path)
+    logger.info("%d sheets saved to %s", len(sheets), file_path)
+    return file_path
+
+@_instrumented
+def export_workbooks(workbooks, max_workers=None, autofit=True, rows_per_sheet=None, columns_per_sheet=None):
+    """
+    Write many independent Excel files in parallel across a process pool.
+
+    Parameters:
+    - workbooks: dict - Mapping of file path to a {sheet name: pandas.DataFrame} mapping (see `raw_data_to_excel_batch`).
+    - max_workers: int - Number of worker processes. Defaults to the number of CPUs.
+    - autofit: bool or dict - Column widths, with the same meaning as in `raw_data_to_excel`. Default is True.
+    - rows_per_sheet, columns_per_sheet: int - Sheet size limits, as in `raw_data_to_excel`.
+
+    Returns:
+    - list: The paths of the written files, in the order they were given.
+
+    Notes:
+    - The workbooks are written in worker processes, so only the 'total' timing and the 'files' counter
+      reach the metrics hooks of the calling process.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(raw_data_to_excel_batch, sheets, file_path, autofit, rows_per_sheet, columns_per_sheet)
+            for file_path, sheets in workbooks.items()
+        ]
+        paths = [future.result() for future in futures]
+    _count('files', len(paths))
+    return paths
+
+def _open_workbook(file_path):
+    """ Load an existing workbook, or create an empty one without the default sheet """
+    if os.path.exists(file_path):
+        return load_workbook(file_path)
+    workbook = Workbook()
+    if 'Sheet' in workbook.sheetnames:
+        del workbook['Sheet']
+    return workbook
+
+def _table_name_from_sheet(sheet_name):
+    """ Build a valid Excel table name (letters, digits, underscores; not a cell reference) from a sheet name """
+    name = re.sub(r'[^0-9A-Za-z_]', '_', str(sheet_name).strip())
+    if not name or not (name[0].isalpha() or name[0] == '_') or re.fullmatch(r'[A-Za-z]{1,3}\d+|[RrCc]', name):
+        name = f"_{name}"
+    return name
+
+def _unique_table_name(workbook, base_name):
+    """ Return `base_name`, suffixed with a counter if a table with that name already exists in the workbook """
+    return _unique_name(base_name, {name.lower() for worksheet in workbook.worksheets for name in worksheet.tables})
+
+def _unique_name(base_name, existing):
+    """ Return `base_name`, suffixed with a counter if it is in `existing` (a set of lowercase names) """
+    name = base_name
+    counter = 2
+    while name.lower() in existing:
+        name = f"{base_name}_{counter}"
+        counter += 1
+    return name
+
+def _part_sheet_name(sheet_name, part):
+    """ Name of the `part`-th sheet (1-based) of data split over several sheets, within Excel's 31-character limit """
+    if part == 1:
+        return sheet_name
+    suffix = f" ({part})"
+    return f"{sheet_name[:31 - len(suffix)]}{suffix}"
+
+def _is_part_sheet(name, sheet_name):
+    """ True if `name` is `sheet_name` or one of its numbered continuation sheets """
+    if name == sheet_name:
+        return True
+    match = re.fullmatch(r'.* \((\d+)\)', name)
+    return bool(match) and int(match.group(1)) > 1 and name == _part_sheet_name(sheet_name, int(match.group(1)))
+
+class _SheetSplitter:
+    """
+    Cuts a stream of DataFrame chunks into pieces that each fit on one sheet.
+
+    `split(chunk)` yields (part, piece) pairs, where `part` is the 1-based number of the sheet the piece belongs on.
+    Rows fill a sheet up to `rows_per_sheet`; wider data is cut into blocks of `columns_per_sheet` columns, numbered
+    left to right within each block of rows. Every part of the first chunk is yielded, even an empty one, so each
+    sheet gets its header.
+    """
+
+    def __init__(self, rows_per_sheet=None, columns_per_sheet=None):
+        self.rows_per_sheet = EXCEL_MAX_ROWS - 1 if rows_per_sheet is None else rows_per_sheet
+        self.columns_per_sheet = EXCEL_MAX_COLUMNS if columns_per_sheet is None else columns_per_sheet
+        if not 1 <= self.rows_per_sheet <= EXCEL_MAX_ROWS - 1:
+            raise ValueError(f"rows_per_sheet must be between 1 and {EXCEL_MAX_ROWS - 1}.")
+        if not 1 <= self.columns_per_sheet <= EXCEL_MAX_COLUMNS:
+            raise ValueError(f"columns_per_sheet must be between 1 and {EXCEL_MAX_COLUMNS}.")
+        self.row_block = 0
+        self.block_rows = 0
+
+    def split(self, chunk):
+        column_starts = range(0, max(len(chunk.columns), 1), self.columns_per_sheet)
+        offset = 0
+        while True:
+            if self.block_rows == self.rows_per_sheet and offset < len(chunk):
+                self.row_block += 1
+                self.block_rows = 0
+            take = min(len(chunk) - offset, self.rows_per_sheet - self.block_rows)
+            rows = chunk if take == len(chunk) else chunk.iloc[offset:offset + take]
+            for block, start in enumerate(column_starts):
+                piece = rows if len(column_starts) == 1 else rows.iloc[:, start:start + self.columns_per_sheet]
+                yield self.row_block * len(column_starts) + block + 1, piece
+            offset += take
+            self.block_rows += take
+            if offset >= len(chunk):
+                return
+
+def _write_table_parts(workbook, sheet_name, df, autofit, table_name, rows_per_sheet=None, columns_per_sheet=None):
+    """ Write `df` as one table sheet per part (see `_SheetSplitter`), replacing earlier parts; returns the number of sheets """
+    splitter = _SheetSplitter(rows_per_sheet, columns_per_sheet)
+    for name in workbook.sheetnames:
+        if _is_part_sheet(name, sheet_name):
+            del workbook[name]
+    parts = 0
+    for part, piece in splitter.split(df):
+        _write_table_sheet(workbook, _part_sheet_name(sheet_name, part), piece, autofit, table_name)
+        parts += 1
+    return parts
+
+def _write_table_sheet(workbook, sheet_name, df, autofit=True, table_name="raw_data"):
+    """ (Re)create `sheet_name` in an openpyxl workbook and write `df` to it as a styled table """
+    if sheet_name in workbook.sheetnames:
+        del workbook[sheet_name]
+
+    worksheet = workbook.create_sheet(sheet_name)
+
+    with _stage('write_rows', sheet=sheet_name):
+        for row in dataframe_to_rows(df, index=False, header=True):
+            worksheet.append(row)
+    _count('rows', len(df), sheet=sheet_name)
+
+    table = Table(displayName=_unique_table_name(workbook, table_name), ref=worksheet.dimensions)
+    style = TableStyleInfo(
+        name="TableStyleMedium9",
+        showFirstColumn=False,
+        showLastColumn=False,
+        showRowStripes=True,
+        showColumnStripes=True
+    )
+    table.tableStyleInfo = style
+    worksheet.add_table(table)
+
+#-----------Adjusting cells--------------
+    with _stage('autofit', sheet=sheet_name):
+        for idx, width in enumerate(_resolve_widths(df, autofit), start=1):
+            if width is not None:
+                worksheet.column_dimensions[get_column_letter(idx)].width = width
+    return worksheet
+
+@_instrumented
+def compute_column_widths(df, sample_size=None, quantile=None, padding=2):
+    """
+    Compute Excel column widths from the contents of a DataFrame using vectorized string lengths.
+
+    Parameters:
+    - df: pandas.DataFrame - The data the widths are computed for.
+    - sample_size: int - If set and the DataFrame has more rows, estimate widths from a random sample of this many rows.
+    - quantile: float - If set (e.g. 0.95), use this quantile of the value lengths instead of the maximum,
+      so a few very long values do not blow up a column.
+    - padding: int - Extra characters added to every width. Default is 2.
+
+    Returns:
+    - dict: Column name to width. The header length is always taken into account.
+    """
+    return dict(zip(df.columns, _column_widths(df, sample_size, quantile, padding)))
+
+def _column_widths(df, sample_size=None, quantile=None, padding=2):
+    """ Positional variant of `compute_column_widths`, safe for duplicate column names """
+    if sample_size is not None and len(df) > sample_size:
+        df = df.sample(n=sample_size, random_state=0)
+    widths = []
+    for position, column in enumerate(df.columns):
+        values = df.iloc[:, position]
+        lengths = values[values.notna()].astype(str).str.len()
+        if len(lengths):
+            value_length = lengths.quantile(quantile) if quantile is not None else lengths.max()
+        else:
+            value_length = 0
+        widths.append(int(max(len(str(column)), value_length)) + padding)
+    return widths
+
+def _resolve_widths(df, autofit):
+    """ Turn an `autofit` argument into one width (or None) per column of `df` """
+    if autofit is True:
+        return _column_widths(df)
+    if isinstance(autofit, dict):
+        return [autofit.get(column) for column in df.columns]
+    return [None] * len(df.columns)
+
+def _iter_frames(data):
+    """ Yield DataFrame chunks from either a single DataFrame or an iterable of DataFrames """
+    if isinstance(data, pd.DataFrame):
+        yield data
+    else:
+        for chunk in data:
+            yield chunk
+
+_XML_ATTRIBUTE = re.compile(r'([\w:.-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+_XML_ENTITIES = {'&quot;': '"', '&apos;': "'"}
+_XML_ENTITIES_ESCAPE = {'"': '&quot;'}
+_CELL_STYLE = re.compile(rb'(<c\b[^>]*?\ss=")(\d+)(")')
+_WORKSHEET_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+_TABLE_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.table+xml'
+_TABLE_RELATIONSHIP = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/table'
+
+def _xml_attributes(tag):
+    """ Attributes of an XML start tag, unescaped """
+    return {key: unescape(double or single, _XML_ENTITIES) for key, double, single in _XML_ATTRIBUTE.findall(tag)}
+
+def _xml_tags(xml, local_name):
+    """ Start tags (or empty elements) named `local_name`, with any namespace prefix """
+    return re.findall(rf'<(?:\w+:)?{local_name}\b[^>]*>', xml)
+
+def _insert_before_end_tag(xml, local_name, text):
+    """ Insert `text` before the last end tag named `local_name`; a self-closing element is expanded first """
+    matches = list(re.finditer(rf'</(?:\w+:)?{local_name}>', xml))
+    if matches:
+        position = matches[-1].start()
+        return xml[:position] + text + xml[position:]
+    empty = re.search(rf'<((?:\w+:)?{local_name})\b([^>]*?)\s*/>', xml)
+    return xml[:empty.start()] + f"<{empty.group(1)}{empty.group(2)}>{text}</{empty.group(1)}>" + xml[empty.end():]
+
+def _relationships_path(part):
+    """ Name of the relationships part of `part` """
+    return posixpath.join(posixpath.dirname(part), '_rels', posixpath.basename(part) + '.rels')
+
+def _read_relationships(archive, part):
+    """ Relationship id -> (type, part name) for the internal relationships of `part`; {} if it has none """
+    rels_path = _relationships_path(part)
+    if rels_path not in archive.namelist():
+        return {}
+    relationships = {}
+    for tag in _xml_tags(archive.read(rels_path).decode('utf-8'), 'Relationship'):
+        attributes = _xml_attributes(tag)
+        if attributes.get('TargetMode') == 'External':
+            continue
+        target = attributes['Target']
+        if target.startswith('/'):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join(posixpath.dirname(part), target))
+        relationships[attributes['Id']] = (attributes['Type'], target)
+    return relationships
+
+def _workbook_sheets(workbook_xml):
+    """ (tag, name, relationship id) of the sheets of a workbook.xml, in tab order """
+    sheets = []
+    for tag in _xml_tags(workbook_xml, 'sheet'):
+        attributes = _xml_attributes(tag)
+        relationship_id = next(value for key, value in attributes.items() if key.endswith(':id'))
+        sheets.append((tag, attributes['name'], relationship_id))
+    return sheets
+
+def _free_part_name(used, pattern):
+    """ First `pattern.format(n)` (n = 1, 2, ...) not in `used`; the name is added to `used` """
+    number = 1
+    while pattern.format(number) in used:
+        number += 1
+    used.add(pattern.format(number))
+    return pattern.format(number)
+
+def _merge_cell_formats(styles_xml, new_styles_xml):
+    """
+    Append the cell formats of `new_styles_xml` (all but the default one) to `styles_xml`.
+
+    Write-only sheets only style cells with number formats (dates), so only the number format of each cell format
+    is carried over. Returns the new styles.xml and a dict of old -> new cell format index.
+    """
+    new_formats = {int(attributes['numFmtId']): attributes['formatCode']
+                   for attributes in map(_xml_attributes, _xml_tags(new_styles_xml, 'numFmt'))}
+    new_cell_formats = re.search(r'<(?:\w+:)?cellXfs\b[^>]*>(.*?)</(?:\w+:)?cellXfs>', new_styles_xml, re.S)
+    new_xfs = _xml_tags(new_cell_formats.group(1), 'xf') if new_cell_formats else []
+    if len(new_xfs) <= 1:
+        return styles_xml, {}
+
+    cell_formats = re.search(r'<((?:\w+:)?)cellXfs\b[^>]*>(.*?)</\1cellXfs>', styles_xml, re.S)
+    prefix = cell_formats.group(1)
+    formats = {attributes['formatCode']: int(attributes['numFmtId'])
+               for attributes in map(_xml_attributes, _xml_tags(styles_xml, 'numFmt'))}
+    next_format_id = max([163] + list(formats.values())) + 1
+    count = len(_xml_tags(cell_formats.group(2), 'xf'))
+    added_formats = []
+    added_xfs = []
+    mapping = {}
+    for index, tag in enumerate(new_xfs[1:], start=1):
+        format_id = int(_xml_attributes(tag).get('numFmtId', 0))
+        if format_id in new_formats:
+            code = new_formats[format_id]
+            if code not in formats:
+                formats[code] = next_format_id
+                added_formats.append(f'<{prefix}numFmt numFmtId="{next_format_id}" formatCode="{escape(code, _XML_ENTITIES_ESCAPE)}"/>')
+                next_format_id += 1
+            format_id = formats[code]
+        added_xfs.append(f'<{prefix}xf numFmtId="{format_id}" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>')
+        mapping[index] = count + index - 1
+
+    styles_xml = _insert_before_end_tag(styles_xml, 'cellXfs', ''.join(added_xfs))
+    styles_xml = re.sub(r'(<(?:\w+:)?cellXfs\b[^>]*?\scount=")\d+', rf'\g<1>{count + len(added_xfs)}', styles_xml, count=1)
+    if added_formats:
+        if _xml_tags(styles_xml, 'numFmts'):
+            styles_xml = _insert_before_end_tag(styles_xml, 'numFmts', ''.join(added_formats))
+            styles_xml = re.sub(r'(<(?:\w+:)?numFmts\b[^>]*?\scount=")\d+', rf'\g<1>{len(formats)}', styles_xml, count=1)
+        else:
+            style_sheet = re.search(r'<(?:\w+:)?styleSheet\b[^>]*>', styles_xml)
+            styles_xml = (styles_xml[:style_sheet.end()] + f'<{prefix}numFmts count="{len(added_formats)}">'
+                          + ''.join(added_formats) + f'</{prefix}numFmts>' + styles_xml[style_sheet.end():])
+    return styles_xml, mapping
+
+def _copy_sheet_xml(source, target, style_map):
+    """ Stream a worksheet part from `source` to `target`, renumbering cell formats with `style_map` """
+    if not style_map:
+        shutil.copyfileobj(source, target)
+        return
+    def restyle(match):
+        return match.group(1) + str(style_map.get(int(match.group(2)), 0)).encode() + match.group(3)
+
+    pending = b''
+    while True:
+        block = source.read(1 << 20)
+        data = pending + block
+        # Only rewrite up to the last complete tag; the rest is carried over to the next block
+        cut = data.rfind(b'>') + 1 if block else len(data)
+        data, pending = data[:cut], data[cut:]
+        target.write(_CELL_STYLE.sub(restyle, data))
+        if not block:
+            return
+
+def _zip_copy(source, name, out):
+    """ Stream the member `name` of zip `source` into zip `out` """
+    info = source.getinfo(name)
+    target = zipfile.ZipInfo(name, info.date_time)
+    target.compress_type = zipfile.ZIP_DEFLATED
+    with source.open(info) as src, out.open(target, 'w', force_zip64=info.file_size > zipfile.ZIP64_LIMIT) as dst:
+        shutil.copyfileobj(src, dst)
+
+def _replace_sheets(source_path, parts_path, sheet_name, out_path):
+    """
+    Write to `out_path` the workbook `source_path` with `sheet_name` and its numbered parts replaced by the sheets
+    of the workbook `parts_path` (written by openpyxl), which are added after the other sheets.
+
+    The merge works on the parts of the xlsx zip files: every other sheet is copied byte for byte with its tables,
+    charts, drawings, styles and column widths, and the new sheets are streamed in, so neither workbook is loaded.
+    """
+    with zipfile.ZipFile(source_path) as source, zipfile.ZipFile(parts_path) as parts, \
+            zipfile.ZipFile(out_path, 'w', zipfile.ZIP_DEFLATED) as out:
+        used_names = set(source.namelist())
+        content_types = source.read('[Content_Types].xml').decode('utf-8')
+        workbook_xml = source.read('xl/workbook.xml').decode('utf-8')
+        workbook_rels_xml = source.read('xl/_rels/workbook.xml.rels').decode('utf-8')
+        relationships = _read_relationships(source, 'xl/workbook.xml')
+
+        # Drop the replaced sheets with their relationships and tables, and the calculation chain
+        # (it refers to sheets by position; Excel rebuilds it)
+        sheets = _workbook_sheets(workbook_xml)
+        dropped_positions = [position for position, (_, name, _) in enumerate(sheets) if _is_part_sheet(name, sheet_name)]
+        dropped_ids = set()
+        dropped_parts = set()
+        for position in dropped_positions:
+            tag, _, relationship_id = sheets[position]
+            workbook_xml = workbook_xml.replace(tag, '', 1)
+            part = relationships[relationship_id][1]
+            dropped_ids.add(relationship_id)
+            dropped_parts.update({part, _relationships_path(part)})
+            dropped_parts.update(target for relationship_type, target in _read_relationships(source, part).values()
+                                 if relationship_type == _TABLE_RELATIONSHIP)
+        for relationship_id, (relationship_type, part) in relationships.items():
+            if relationship_type.endswith('/calcChain'):
+                dropped_ids.add(relationship_id)
+                dropped_parts.add(part)
+
+        def new_position(position):
+            if position in dropped_positions:
+                return None
+            return position - sum(1 for dropped in dropped_positions if dropped < position)
+
+        def renumber_defined_name(match):
+            local_sheet = re.search(r'\slocalSheetId="(\d+)"', match.group(2))
+            if local_sheet is None:
+                return match.group(0)
+            position = new_position(int(local_sheet.group(1)))
+            if position is None:
+                return ''
+            return match.group(0).replace(local_sheet.group(0), f' localSheetId="{position}"', 1)
+
+        def renumber_view(match):
+            return re.sub(r'(\s(?:activeTab|firstSheet)=")(\d+)',
+                          lambda tab: f"{tab.group(1)}{new_position(int(tab.group(2))) or 0}", match.group(0))
+
+        workbook_xml = re.sub(r'<((?:\w+:)?definedName)\b([^>]*)>.*?</\1>', renumber_defined_name, workbook_xml, flags=re.S)
+        workbook_xml = re.sub(r'<(?:\w+:)?workbookView\b[^>]*>', renumber_view, workbook_xml)
+        workbook_rels_xml = ''.join(
+            piece for piece in re.split(r'(<(?:\w+:)?Relationship\b[^>]*>)', workbook_rels_xml)
+            if not (piece.startswith('<') and _xml_attributes(piece).get('Id') in dropped_ids)
+        )
+        content_types = ''.join(
+            piece for piece in re.split(r'(<(?:\w+:)?Override\b[^>]*>)', content_types)
+            if not (piece.startswith('<') and _xml_attributes(piece).get('PartName', '').lstrip('/') in dropped_parts)
+        )
+
+        styles_xml, style_map = _merge_cell_formats(source.read('xl/styles.xml').decode('utf-8'),
+                                                    parts.read('xl/styles.xml').decode('utf-8'))
+
+        # Tables and sheet ids must stay unique in the workbook
+        table_ids = set()
+        table_names = set()
+        for name in used_names - dropped_parts:
+            if name.startswith('xl/tables/') and name.endswith('.xml'):
+                attributes = _xml_attributes(_xml_tags(source.read(name).decode('utf-8'), 'table')[0])
+                table_ids.add(int(attributes['id']))
+                table_names.add(attributes['displayName'].lower())
+        sheet_ids = [int(_xml_attributes(tag)['sheetId']) for tag, _, _ in sheets]
+        relationship_ids = {_xml_attributes(tag)['Id'] for tag in _xml_tags(workbook_rels_xml, 'Relationship')}
+        sheets_prefix = re.search(r'<((?:\w+:)?)sheets\b', workbook_xml).group(1)
+        id_attribute = next(key for key in _xml_attributes(sheets[0][0]) if key.endswith(':id'))
+
+        new_sheet_tags = []
+        new_relationships = []
+        new_overrides = []
+        parts_relationships = _read_relationships(parts, 'xl/workbook.xml')
+        for _, name, relationship_id in _workbook_sheets(parts.read('xl/workbook.xml').decode('utf-8')):
+            part = parts_relationships[relationship_id][1]
+            sheet_part = _free_part_name(used_names, 'xl/worksheets/sheet{}.xml')
+            info = parts.getinfo(part)
+            with parts.open(info) as src, out.open(sheet_part, 'w', force_zip64=info.file_size > zipfile.ZIP64_LIMIT // 2) as dst:
+                _copy_sheet_xml(src, dst, style_map)
+
+            sheet_relationships = []
+            for table_relationship_id, (relationship_type, target) in _read_relationships(parts, part).items():
+                table_xml = parts.read(target).decode('utf-8')
+                start_tag = _xml_tags(table_xml, 'table')[0]
+                table_id = max(table_ids | {0}) + 1
+                table_ids.add(table_id)
+                table_name = _unique_name(_xml_attributes(start_tag)['displayName'], table_names)
+                table_names.add(table_name.lower())
+                new_start_tag = re.sub(r'(?<=\s)id="\d+"', f'id="{table_id}"', start_tag)
+                new_start_tag = re.sub(r'(?<=\s)(name|displayName)="[^"]*"', rf'\g<1>="{table_name}"', new_start_tag)
+                table_part = _free_part_name(used_names, 'xl/tables/table{}.xml')
+                out.writestr(table_part, table_xml.replace(start_tag, new_start_tag, 1))
+                new_overrides.append(f'<Override PartName="/{table_part}" ContentType="{_TABLE_CONTENT_TYPE}"/>')
+                sheet_relationships.append(
+                    f'<Relationship Id="{table_relationship_id}" Type="{relationship_type}" Target="/{table_part}"/>'
+                )
+            if sheet_relationships:
+                out.writestr(_relationships_path(sheet_part),
+                             '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                             + ''.join(sheet_relationships) + '</Relationships>')
+
+            new_id = _free_part_name(relationship_ids, 'rId{}')
+            sheet_ids.append(max(sheet_ids + [0]) + 1)
+            new_sheet_tags.append(f'<{sheets_prefix}sheet name="{escape(name, _XML_ENTITIES_ESCAPE)}" '
+                                  f'sheetId="{sheet_ids[-1]}" {id_attribute}="{new_id}"/>')
+            new_relationships.append(
+                f'<Relationship Id="{new_id}" Type="{parts_relationships[relationship_id][0]}" Target="/{sheet_part}"/>'
+            )
+            new_overrides.append(f'<Override PartName="/{sheet_part}" ContentType="{_WORKSHEET_CONTENT_TYPE}"/>')
+
+        rewritten = {
+            'xl/workbook.xml': _insert_before_end_tag(workbook_xml, 'sheets', ''.join(new_sheet_tags)),
+            'xl/_rels/workbook.xml.rels': _insert_before_end_tag(workbook_rels_xml, 'Relationships', ''.join(new_relationships)),
+            'xl/styles.xml': styles_xml,
+        }
+        for name in source.namelist():
+            if name in dropped_parts or name == '[Content_Types].xml':
+                continue
+            if name in rewritten:
+                out.writestr(name, rewritten[name])
+            else:
+                _zip_copy(source, name, out)
+        out.writestr('[Content_Types].xml', _insert_before_end_tag(content_types, 'Types', ''.join(new_overrides)))
+
+def _raw_data_to_excel_streaming(data, file_path, sheet_name, autofit=True, rows_per_sheet=None, columns_per_sheet=None):
+    """
+    Streaming variant of `raw_data_to_excel` built on an openpyxl write-only workbook.
+
+    Rows are written chunk by chunk, so only one chunk is held in memory at a time. Column widths are
+    estimated from the first rows of each sheet because a write-only sheet needs them before the first row.
+    When a sheet is full, the next numbered sheet is started. The other sheets of an existing workbook are
+    kept as they are (see `_replace_sheets`); the new sheets come after them.
+    """
+    splitter = _SheetSplitter(rows_per_sheet, columns_per_sheet)
+    workbook = Workbook(write_only=True)
+
+    # part -> [worksheet, header, data rows]
+    sheets = {}
+    n_rows = 0
+    for chunk in _iter_frames(data):
+        for part, piece in splitter.split(chunk):
+            if part not in sheets:
+                worksheet = workbook.create_sheet(_part_sheet_name(sheet_name, part))
+                with _stage('autofit', sheet=sheet_name):
+                    for idx, width in enumerate(_resolve_widths(piece, autofit), start=1):
+                        if width is not None:
+                            worksheet.column_dimensions[get_column_letter(idx)].width = width
+                header = [str(column) for column in piece.columns]
+                worksheet.append(header)
+                sheets[part] = [worksheet, header, 0]
+            state = sheets[part]
+            with _stage('write_rows', sheet=sheet_name):
+                for row in dataframe_to_rows(piece, index=False, header=False):
+                    state[0].append(row)
+            state[2] += len(piece)
+        _count('rows', len(chunk), sheet=sheet_name)
+        n_rows += len(chunk)
+    if not sheets:
+        # No chunks at all: still replace the sheet, otherwise openpyxl saves a default "Sheet" in its place
+        sheets[1] = [workbook.create_sheet(sheet_name), [], 0]
+
+    for part, (worksheet, header, part_rows) in sheets.items():
+        if header:
+            _add_write_only_table(worksheet, header, part_rows, "raw_data" if part == 1 else f"raw_data_{part}")
+
+    # Save next to the target first: the existing file is still needed while its other sheets are copied
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(suffix='.xlsx', dir=directory)
+    os.close(fd)
+    parts_path = None
+    try:
+        if os.path.exists(file_path):
+            fd, parts_path = tempfile.mkstemp(suffix='.xlsx', dir=directory)
+            os.close(fd)
+            with _stage('save', file=file_path):
+                workbook.save(parts_path)
+            with _stage('copy_sheets', file=file_path):
+                _replace_sheets(file_path, parts_path, sheet_name, tmp_path)
+        else:
+            with _stage('save', file=file_path):
+                workbook.save(tmp_path)
+        os.replace(tmp_path, file_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        if parts_path is not None:
+            os.remove(parts_path)
+    logger.info("Sheet '%s' (%d rows, %d sheets) streamed to %s", sheet_name, n_rows, len(sheets), file_path)
+
+def _add_write_only_table(worksheet, header, n_rows, table_name):
+    """ Add a styled table over the header and `n_rows` data rows of a write-only worksheet """
+    table = Table(displayName=table_name, ref=f"A1:{get_column_letter(len(header))}{n_rows + 1}")
+    table._initialise_columns()
+    for table_column, name in zip(table.tableColumns, header):
+        table_column.name = name
+    table.tableStyleInfo = TableStyleInfo(
+        name="TableStyleMedium9",
+        showFirstColumn=False,
+        showLastColumn=False,
+        showRowStripes=True,
+        showColumnStripes=True
+    )
+    with warnings.catch_warnings():
+        # openpyxl warns on every add_table in write-only mode, whether or not the columns are set. They are set
+        # above from the header, so the warning is noise (one per streamed sheet); only this message is silenced
+        warnings.filterwarnings('ignore', message='In write-only mode you must add table columns manually')
+        worksheet.add_table(table)
+
+@_instrumented
+def raw_data_to_excel_with_all_charts(df, file_path, chart_config, totals=None, autofit=False, shared_summaries=False, cache_aggregations=False,
+                                      rows_per_sheet=None, columns_per_sheet=None, raw_data_rows=None, columnar_path=None):
+    """
+    Write raw data to an Excel file and create a clean dashboard with various chart types using `xlsxwriter`.
+
+    Parameters:
+    - df: pandas.DataFrame or iterable of pandas.DataFrame - The data to write to the Excel file.
+      An iterable of DataFrame chunks (e.g. from `pd.read_csv(chunksize=...)`) is streamed: raw rows are written
+      as they arrive and chart summaries and totals are kept as running aggregates.
+    - file_path: str - Path to save the Excel file.
+    - chart_config: dict - Dictionary to configure charts.
+        Keys are chart types (e.g., "bar", "line", "pie").
+        Values are dicts with keys:
+            - 'category_col': str - Column to use as categories.
+            - 'value_col': str - Column to use as values.
+    - totals: list - List of column names to calculate totals for. If None, totals will not be shown.
+    - autofit: bool or dict - True to size the Raw Data columns from the data, or a dict of column widths
+      (e.g. from `compute_column_widths`). Default is False (widths are left untouched).
+    - shared_summaries: bool - If True, charts over the same category column share one summary block
+      on the Dashboard instead of getting a block each. Default is False.
+    - cache_aggregations: bool or hashable - If True, reuse the aggregates computed for the same DataFrame object in
+      an earlier call (same shape and columns; values edited in place are not detected). Any other value is used as
+      the cache key, e.g. the path and modification time of the file the data was read from; the key must change when
+      the data does. Only applies to DataFrame input. Default is False.
+    - rows_per_sheet, columns_per_sheet: int - Sheet size limits, as in `raw_data_to_excel`. Raw data over the limits
+      is split over "Raw Data", "Raw Data (2)", ... sheets.
+    - raw_data_rows: int - If set, only the first `raw_data_rows` rows are written to the Raw Data sheet, as a sample.
+      The dashboard is still computed from all rows. Default is None (all rows).
+    - columnar_path: str - If set, also write all rows to this Parquet (.parquet) or Arrow IPC (.arrow, .feather)
+      file (see `write_columnar`; requires pyarrow). Default is None.
+    """
+    splitter = _SheetSplitter(rows_per_sheet, columns_per_sheet)
+    if not isinstance(df, pd.DataFrame):
+        _raw_data_to_excel_with_all_charts_streaming(df, file_path, chart_config, totals, autofit, shared_summaries,
+                                                     splitter, raw_data_rows, columnar_path)
+        return
+
+    if columnar_path is not None:
+        with _stage('columnar', file=columnar_path):
+            with _ColumnarWriter(columnar_path) as columnar:
+                columnar.write(df)
+
+    raw = df if raw_data_rows is None else df.head(raw_data_rows)
+    writer = pd.ExcelWriter(file_path, engine='xlsxwriter')
+    try:
+        for part, piece in splitter.split(raw):
+            raw_sheet_name = _part_sheet_name('Raw Data', part)
+            with _stage('write_rows', sheet=raw_sheet_name):
+                piece.to_excel(writer, sheet_name=raw_sheet_name, index=False)
+            _count('rows', len(piece), sheet=raw_sheet_name)
+            raw_sheet = writer.sheets[raw_sheet_name]
+            with _stage('autofit', sheet=raw_sheet_name):
+                for idx, width in enumerate(_resolve_widths(piece, autofit)):
+                    if width is not None:
+                        raw_sheet.set_column(idx, idx, width)
+
+        with _stage('aggregate'):
+            numeric_columns = _numeric_columns(df)
+            plan = _plan_aggregations(chart_config, totals, numeric_columns)
+            if cache_aggregations is not False and cache_aggregations is not None:
+                aggregates = _cached_aggregates(df, plan, cache_aggregations)
+            else:
+                aggregates = _aggregate_chunk(df, plan)
+        with _stage('dashboard'):
+            _write_dashboard(writer.book, chart_config, totals, plan, aggregates, shared_summaries)
+    finally:
+        with _stage('save', file=file_path):
+            writer.close()
+
+    logger.info("Excel file with dashboard saved at: %s", file_path)
+
+_COUNT_COLUMN = '__count__'
+_AGGREGATION_CACHE = OrderedDict()
+_AGGREGATION_CACHE_SIZE = 32
+
+def _numeric_columns(df):
+    """ Names of the numeric columns of `df`, used to pick between sums and counts """
+    return {column for column in df.columns if pd.api.types.is_numeric_dtype(df[column])}
+
+def _plan_aggregations(chart_config, totals, numeric_columns):
+    """
+    Group the chart specs by category column so each category column is aggregated in a single pass.
+
+    Returns a dict with:
+    - 'groups': dict of category column -> list of value columns to sum (the group count is always computed).
+    - 'totals_sum' / 'totals_count': totals columns reduced with a sum or a non-null count.
+    """
+    groups = {}
+    for config in chart_config.values():
+        category_col = config.get('category_col')
+        value_col = config.get('value_col')
+        if not category_col or not value_col:
+            continue
+        sums = groups.setdefault(category_col, [])
+        if value_col in numeric_columns and value_col not in sums:
+            sums.append(value_col)
+    totals = list(dict.fromkeys(totals or []))
+    return {
+        'groups': groups,
+        'totals_sum': [column for column in totals if column in numeric_columns],
+        'totals_count': [column for column in totals if column not in numeric_columns],
+        'numeric_columns': numeric_columns,
+    }
+
+def _aggregate_chunk(df, plan):
+    """
+    Compute the partial aggregates of one DataFrame (or chunk) described by `plan`.
+
+    Returns a dict with:
+    - 'groups': dict of category column -> DataFrame indexed by category, holding the planned sums and the row count.
+    - 'totals': dict of column -> total (sum for numeric columns, non-null count otherwise).
+    """
+    groups = {}
+    for category_col, sum_columns in plan['groups'].items():
+        grouped = df.groupby(category_col)
+        summary = grouped[sum_columns].sum() if sum_columns else pd.DataFrame(index=grouped.size().index)
+        summary[_COUNT_COLUMN] = grouped.size()
+        groups[category_col] = summary
+
+    totals_values = {}
+    present_sum = [column for column in plan['totals_sum'] if column in df.columns]
+    present_count = [column for column in plan['totals_count'] if column in df.columns]
+    if present_sum:
+        totals_values.update(df[present_sum].sum().items())
+    if present_count:
+        totals_values.update(df[present_count].count().items())
+    return {'groups': groups, 'totals': totals_values}
+
+def _coerce_to_plan(chunk, plan):
+    """
+    Convert the columns `plan` sums to numbers in a later chunk.
+
+    The plan is made from the first chunk, but a chunked reader picks the dtypes of each chunk on its own: a column
+    read as integers in the first chunk can come back as text in the next. Values that are not numbers become NaN.
+    """
+    sum_columns = set(plan['totals_sum'])
+    for columns in plan['groups'].values():
+        sum_columns.update(columns)
+    to_convert = [
+        column for column in sum_columns
+        if column in chunk.columns and not pd.api.types.is_numeric_dtype(chunk[column])
+    ]
+    if not to_convert:
+        return chunk
+    chunk = chunk.copy()
+    for column in to_convert:
+        chunk[column] = pd.to_numeric(chunk[column], errors='coerce')
+    return chunk
+
+def _merge_aggregates(running, partial):
+    """ Merge the partial aggregates of a chunk into the running aggregates """
+    if running is None:
+        return partial
+    for category_col, summary in partial['groups'].items():
+        previous = running['groups'].get(category_col)
+        if previous is None:
+            running['groups'][category_col] = summary
+        else:
+            running['groups'][category_col] = pd.concat([previous, summary]).groupby(level=0).sum()
+    for column, value in partial['totals'].items():
+        running['totals'][column] = running['totals'].get(column, 0) + value
+    return running
+
+def _cached_aggregates(df, plan, cache_key=True):
+    """
+    Return the aggregates for `plan`, reusing the result of an earlier call.
+
+    With `cache_key=True` a result is reused for the same DataFrame object with the same shape and columns; a weak
+    reference makes sure a new DataFrame that got the id of a collected one never matches. Any other `cache_key` is
+    used as the key itself. The lookup is free next to the aggregation, but values changed in place are not seen.
+    """
+    plan_key = repr(sorted((key, value) for key, value in plan.items() if key != 'numeric_columns'))
+    if cache_key is True:
+        key = ('frame', id(df), df.shape, tuple(df.columns), plan_key)
+    else:
+        key = ('key', cache_key, plan_key)
+    entry = _AGGREGATION_CACHE.get(key)
+    if entry is not None and (entry[0] is None or entry[0]() is df):
+        _AGGREGATION_CACHE.move_to_end(key)
+        return entry[1]
+    aggregates = _aggregate_chunk(df, plan)
+    _AGGREGATION_CACHE[key] = (weakref.ref(df) if cache_key is True else None, aggregates)
+    if len(_AGGREGATION_CACHE) > _AGGREGATION_CACHE_SIZE:
+        _AGGREGATION_CACHE.popitem(last=False)
+    return aggregates
+
+def _summary_blocks(chart_config, plan, aggregates, shared_summaries):
+    """
+    Lay out the Dashboard summary blocks.
+
+    Returns a list of (header, summary DataFrame, [(chart_type, value column position)]) in `chart_config` order.
+    The summary columns are positional (categories first), since a value column may be the category column itself.
+    Sums are ordered by category and counts by descending frequency; a shared block holding any sum is
+    ordered by category.
+    """
+    charts_by_block = OrderedDict()
+    for chart_type, config in chart_config.items():
+        category_col = config.get('category_col')
+        value_col = config.get('value_col')
+        if not category_col or not value_col or category_col not in aggregates['groups']:
+            continue
+        block_key = category_col if shared_summaries else chart_type
+        charts_by_block.setdefault(block_key, []).append(chart_type)
+
+    blocks = []
+    for chart_types in charts_by_block.values():
+        category_col = chart_config[chart_types[0]]['category_col']
+        grouped = aggregates['groups'][category_col]
+        value_cols = list(dict.fromkeys(chart_config[chart_type]['value_col'] for chart_type in chart_types))
+        if any(value_col in plan['numeric_columns'] for value_col in value_cols):
+            grouped = grouped.sort_index()
+        else:
+            grouped = grouped.sort_values(_COUNT_COLUMN, ascending=False, kind='stable')
+        summary = pd.DataFrame({0: grouped.index})
+        for position, value_col in enumerate(value_cols, start=1):
+            source = value_col if value_col in plan['numeric_columns'] else _COUNT_COLUMN
+            summary[position] = grouped[source].values
+        blocks.append(([category_col] + value_cols, summary, [
+            (chart_type, value_cols.index(chart_config[chart_type]['value_col']) + 1) for chart_type in chart_types
+        ]))
+    return blocks
+
+def _write_dashboard(workbook, chart_config, totals, plan, aggregates, shared_summaries=False):
+    """ Write the totals block and the summary blocks with their charts on a new Dashboard sheet """
+    dashboard = workbook.add_worksheet('Dashboard')
+    row_offset = 0
+    if totals:
+        dashboard.write_row(row_offset, 0, ["Column", "Total"])
+        row_offset += 1
+        for column in dict.fromkeys(totals):
+            if column in aggregates['totals']:
+                dashboard.write_row(row_offset, 0, [column, aggregates['totals'][column]])
+                row_offset += 1
+        row_offset += 1
+
+    for header, summary, block_charts in _summary_blocks(chart_config, plan, aggregates, shared_summaries):
+        dashboard.write_row(row_offset, 0, header)  # Write header
+        for idx, row in enumerate(summary.itertuples(index=False), start=1):
+            dashboard.write_row(row_offset + idx, 0, row)
+
+        chart_col = len(summary.columns) + 1
+        for chart_type, value_position in block_charts:
+            category_col = chart_config[chart_type]['category_col']
+            value_col = chart_config[chart_type]['value_col']
+
+            chart = None
+            if chart_type == "bar":
+                chart = workbook.add_chart({'type': 'column'})
+            elif chart_type == "line":
+                chart = workbook.add_chart({'type': 'line'})
+            elif chart_type == "pie":
+                chart = workbook.add_chart({'type': 'pie'})
+                chart.set_style(10)
+            elif chart_type == "doughnut":
+                chart = workbook.add_chart({'type': 'doughnut'})
+                chart.set_style(10)
+
+            chart.add_series({
+                'name': f'{value_col} by {category_col}',
+                'categories': [f'Dashboard', row_offset + 1, 0, row_offset + len(summary), 0],
+                'values': [f'Dashboard', row_offset + 1, value_position, row_offset + len(summary), value_position],
+                'data_labels': {'value': True, 'category': True},
+            })
+
+            if chart_type in ["bar", "line"]:
+                chart.set_x_axis({'name': category_col, 'name_font': {'size': 12, 'bold': True}})
+                chart.set_y_axis({'name': value_col, 'name_font': {'size': 12, 'bold': True}})
+            elif chart_type in ["pie", "doughnut"]:
+                chart.set_title({'name': f'{value_col} by {category_col}'})
+
+            if chart:
+                dashboard.insert_chart(row_offset, chart_col, chart, {'x_scale': 1.5, 'y_scale': 1.5})
+            chart_col += 12
+        row_offset += len(summary) + 5
+
+def _raw_data_to_excel_with_all_charts_streaming(chunks, file_path, chart_config, totals=None, autofit=False, shared_summaries=False,
+                                                 splitter=None, raw_data_rows=None, columnar_path=None):
+    """
+    Streaming variant of `raw_data_to_excel_with_all_charts`.
+
+    The workbook is opened in xlsxwriter `constant_memory` mode and Raw Data rows are flushed as each chunk
+    arrives. Chart summaries and totals are accumulated as partial aggregates and merged once at the end,
+    so peak memory depends on the chunk size and the number of categories, not on the number of rows.
+    """
+    splitter = splitter or _SheetSplitter()
+    workbook = xlsxwriter.Workbook(file_path, {'constant_memory': True})
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    datetime_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+    columnar = _ColumnarWriter(columnar_path) if columnar_path is not None else None
+
+    # part -> [worksheet, column formats, next row]
+    raw_sheets = {}
+    plan = None
+    aggregates = None
+    remaining = raw_data_rows
+    try:
+        for chunk in chunks:
+            if plan is None:
+                plan = _plan_aggregations(chart_config, totals, _numeric_columns(chunk))
+
+            raw = chunk if remaining is None else chunk.iloc[:remaining]
+            for part, piece in splitter.split(raw):
+                raw_sheet_name = _part_sheet_name('Raw Data', part)
+                if part not in raw_sheets:
+                    raw_sheet = workbook.add_worksheet(raw_sheet_name)
+                    column_formats = [
+                        datetime_format if pd.api.types.is_datetime64_any_dtype(piece.iloc[:, position]) else None
+                        for position in range(len(piece.columns))
+                    ]
+                    raw_sheet.write_row(0, 0, [str(column) for column in piece.columns], header_format)
+                    with _stage('autofit', sheet=raw_sheet_name):
+                        for idx, width in enumerate(_resolve_widths(piece, autofit)):
+                            if width is not None:
+                                raw_sheet.set_column(idx, idx, width)
+                    raw_sheets[part] = [raw_sheet, column_formats, 1]
+                state = raw_sheets[part]
+                raw_sheet, column_formats, row_idx = state
+                with _stage('write_rows', sheet=raw_sheet_name):
+                    values = piece.astype(object).where(piece.notna(), None)
+                    for row in values.itertuples(index=False):
+                        for col_idx, value in enumerate(row):
+                            if value is not None:
+                                raw_sheet.write(row_idx, col_idx, value, column_formats[col_idx])
+                        row_idx += 1
+                state[2] = row_idx
+                _count('rows', len(piece), sheet=raw_sheet_name)
+            if remaining is not None:
+                remaining -= len(raw)
+
+            with _stage('aggregate'):
+                aggregates = _merge_aggregates(aggregates, _aggregate_chunk(_coerce_to_plan(chunk, plan), plan))
+            if columnar is not None:
+                with _stage('columnar', file=columnar_path):
+                    columnar.write(chunk)
+    except BaseException:
+        if columnar is not None:
+            columnar.abort()
+        raise
+    if columnar is not None:
+        columnar.close()
+
+    if not raw_sheets:
+        workbook.add_worksheet('Raw Data')
+    if plan is None:
+        plan = _plan_aggregations({}, None, set())
+        aggregates = {'groups': {}, 'totals': {}}
+    with _stage('dashboard'):
+        _write_dashboard(workbook, chart_config, totals, plan, aggregates, shared_summaries)
+    with _stage('save', file=file_path):
+        workbook.close()
+
+    logger.info("Excel file with dashboard saved at: %s", file_path)
@@ -0,0 +1,433 @@
+"""Fetching data and attachments from KoBoToolbox and SurveyCTO."""
+from koboextractor import KoboExtractor
+import json
+import requests
+import pandas as pd
+import os
+import tempfile
+import threading
+import time
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, unquote
+
+from .metrics import _instrumented, _stage, _count, _submit
+from .normalize import MAIN_TABLE, _normalize_kobo, _merge_tables, _replace_submissions
+
+logger = logging.getLogger(__name__)
+
+@_instrumented
+def fetch_kobo_data(token, form_id, base_url="https://kf.kobotoolbox.org/api/v2", page_size=None, max_workers=4, cache_path=None,
+                    repeat_groups=False):
+    """
+    Fetch data from KoBoToolbox for a specified form and load it into a DataFrame using KoboExtractor.
+    
+    Parameters:
+    - token (str): API token for KoBoToolbox.
+    - form_id (str): The unique identifier of the form to fetch data from.
+    - base_url (str): The base URL for the KoBoToolbox API. Default is for KoBoToolbox.
+    - page_size (int): If set, fetch submissions in pages of this size (`start`/`limit`), requesting pages
+      concurrently over a pooled session. Default is None (a single request).
+    - max_workers (int): Number of pages requested at the same time. Default is 4.
+    - cache_path (str): If set, keep a local copy of the form data at this path (pickle) and only download
+      submissions newer than the latest `_submission_time` already cached, merging them by `_id`.
+    - repeat_groups (bool): If True, split repeat groups into child tables keyed by `_id` and use compact dtypes
+      (see `normalize_kobo_submissions`), and return a dict of DataFrames. Default is False.
+
+    Returns:
+    - df (pandas.DataFrame): Data from KoBoToolbox in a DataFrame format.
+      With `repeat_groups=True`, a dict of table name to DataFrame, with the submissions under 'submissions'.
+    """
+    try:
+        if page_size is None and cache_path is None and repeat_groups:
+            kobo = KoboExtractor(token, base_url)
+            logger.info("Fetching data from KoBoToolbox...")
+            with _stage('download', form=form_id):
+                data = kobo.get_data(form_id)
+            with _stage('normalize', form=form_id):
+                tables = _normalize_kobo(_consume(data['results']))
+            _count('rows', len(tables[MAIN_TABLE]), form=form_id)
+            logger.info("Data fetched successfully! (%d submissions)", len(tables[MAIN_TABLE]))
+            return tables
+
+        if page_size is None and cache_path is None:
+            # Initialize KoboExtractor with token and base URL
+            kobo = KoboExtractor(token, base_url)
+            
+            # Fetch the data for the specified form
+            logger.info("Fetching data from KoBoToolbox...")
+            with _stage('download', form=form_id):
+                data = kobo.get_data(form_id)
+            
+            # Convert the data to a DataFrame
+            with _stage('normalize', form=form_id):
+                df = pd.json_normalize(data['results'])
+            _count('rows', len(df), form=form_id)
+            
+            logger.info("Data fetched successfully! (%d submissions)", len(df))
+            return df
+
+        cached = None
+        query = None
+        if cache_path and os.path.exists(cache_path):
+            with _stage('load_cache', file=cache_path):
+                cached = pd.read_pickle(cache_path)
+            if isinstance(cached, dict) != repeat_groups:
+                logger.warning("Cache %s was written with a different repeat_groups setting; ignoring it", cache_path)
+                cached = None
+        if cached is not None:
+            submissions = cached[MAIN_TABLE] if repeat_groups else cached
+            if '_submission_time' in submissions.columns and len(submissions):
+                watermark = submissions['_submission_time'].max()
+                if isinstance(watermark, pd.Timestamp):
+                    watermark = watermark.strftime('%Y-%m-%dT%H:%M:%S')
+                # $gte plus de-duplication on _id: submissions sharing the watermark second are not lost
+                query = {"_submission_time": {"$gte": str(watermark)}}
+
+        logger.info("Fetching data from KoBoToolbox...")
+        new = _fetch_kobo_pages(token, form_id, base_url, page_size or KOBO_MAX_PAGE_SIZE, max_workers, query, repeat_groups)
+        n_new = len(new[MAIN_TABLE]) if repeat_groups else len(new)
+        _count('rows', n_new, form=form_id)
+
+        if cached is not None:
+            with _stage('merge', form=form_id):
+                if repeat_groups:
+                    df = _replace_submissions(cached, new)
+                else:
+                    df = pd.concat([cached, new], ignore_index=True)
+                    if '_id' in df.columns:
+                        df = df.drop_duplicates('_id', keep='last').reset_index(drop=True)
+        else:
+            df = new
+        if cache_path:
+            with _stage('save', file=cache_path):
+                _atomic_to_pickle(df, cache_path)
+
+        logger.info("Data fetched successfully! (%d new submissions)", n_new)
+        return df
+
+    except Exception:
+        logger.exception("Error fetching data from KoBoToolbox")
+        _count('errors', 1)
+
+KOBO_MAX_PAGE_SIZE = 30000
+
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+def _http_session():
+    """ Return the process-wide pooled `requests.Session`, creating it on first use """
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=32)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _SESSION = session
+        return _SESSION
+
+def _consume(items):
+    """ Yield the items of a list while removing them, so each one can be freed as soon as it is processed """
+    items.reverse()
+    while items:
+        yield items.pop()
+
+def _fetch_kobo_page(url, headers, params, repeat_groups=False):
+    """ Fetch one page of a KoBo v2 `data.json` endpoint and normalize its results """
+    with _stage('download', start=params['start']):
+        response = _http_session().get(url, headers=headers, params=params)
+        response.raise_for_status()
+        payload = response.json()
+    _count('bytes', len(response.content))
+    with _stage('normalize', start=params['start']):
+        if repeat_groups:
+            page = _normalize_kobo(_consume(payload.get('results', [])))
+        else:
+            page = pd.json_normalize(payload.get('results', []))
+    return payload.get('count', 0), page
+
+def _fetch_kobo_pages(token, form_id, base_url, page_size, max_workers, query=None, repeat_groups=False):
+    """
+    Fetch all submissions of a form with `start`/`limit` pagination. The first page reports the total count;
+    the remaining pages are requested concurrently and normalized as they arrive.
+    """
+    url = f"{base_url.rstrip('/')}/assets/{form_id}/data.json"
+    headers = {'Authorization': f'Token {token}'}
+    params = {'limit': page_size, 'sort': json.dumps({'_id': 1})}
+    if query:
+        params['query'] = json.dumps(query)
+
+    count, first_page = _fetch_kobo_page(url, headers, dict(params, start=0), repeat_groups)
+    pages = {0: first_page}
+    starts = range(page_size, count, page_size)
+    if starts:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                _submit(executor, _fetch_kobo_page, url, headers, dict(params, start=start), repeat_groups): start
+                for start in starts
+            }
+            for future in as_completed(futures):
+                pages[futures[future]] = future.result()[1]
+    if repeat_groups:
+        return _merge_tables([pages[start] for start in sorted(pages)])
+    return pd.concat([pages[start] for start in sorted(pages)], ignore_index=True)
+
+def _atomic_to_pickle(df, path):
+    """ Pickle a DataFrame (or a dict of them) next to `path` first, then move it into place """
+    fd, tmp_path = tempfile.mkstemp(suffix='.pkl', dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    try:
+        pd.to_pickle(df, tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+@_instrumented
+def fetch_surveycto_data(isDataset, servername, form_or_dataset_id, username, password, dtype=None, chunksize=None, cache_dir=None):
+    """
+    Fetch data from SurveyCTO for a specified form or dataset and load it into a DataFrame.
+    
+    Parameters:
+    - isDataset (bool): If True, fetches data from a dataset; if False, fetches data from a form.
+    - servername (str): The SurveyCTO server name (without "https://").
+    - form_or_dataset_id (str): The unique ID of the form or dataset to fetch data from.
+    - username (str): The SurveyCTO username for authentication.
+    - password (str): The SurveyCTO password for authentication.
+    - dtype (dict): Optional column dtypes passed to `pd.read_csv`, which avoids type inference on large exports.
+    - chunksize (int): If set, return an iterator of DataFrame chunks of this many rows instead of one DataFrame.
+    - cache_dir (str): If set, keep the last response on disk and send its ETag/Last-Modified validators,
+      so an unchanged form or dataset is not downloaded again.
+
+    Returns:
+    - df (pandas.DataFrame): Data from SurveyCTO in a DataFrame format (an iterator of DataFrames if `chunksize` is set).
+    """
+    if isDataset:
+        endpoint = f"https://{servername}.surveycto.com/api/v2/datasets/data/csv/{form_or_dataset_id}"
+    else:
+        endpoint = f"https://{servername}.surveycto.com/api/v1/forms/data/csv/{form_or_dataset_id}"
+    
+    try:
+        auth = (username, password)
+        
+        logger.info("Fetching data from SurveyCTO...")
+        df = _read_csv_endpoint(endpoint, auth, dtype, chunksize, cache_dir)
+        if chunksize is None:
+            _count('rows', len(df))
+        
+        logger.info("Data fetched successfully!")
+        return df
+
+    except requests.exceptions.HTTPError:
+        logger.exception("HTTP error occurred while fetching data from SurveyCTO")
+        _count('errors', 1)
+    except Exception:
+        logger.exception("Error fetching data from SurveyCTO")
+        _count('errors', 1)
+
+def _read_csv_endpoint(endpoint, auth, dtype=None, chunksize=None, cache_dir=None):
+    """
+    Stream a CSV endpoint into `pd.read_csv` over the pooled session.
+
+    Without a cache the response body is parsed straight from the socket. With a cache the body is
+    streamed to disk in chunks first, and later requests are conditional: a 304 reuses the cached file.
+    """
+    session = _http_session()
+    if not cache_dir:
+        with _stage('download'):
+            response = session.get(endpoint, auth=auth, stream=True)
+            try:
+                response.raise_for_status()
+            except Exception:
+                response.close()
+                raise
+        response.raw.decode_content = True
+        if chunksize is not None:
+            # Chunks are parsed (and the body read) lazily by the caller
+            return _read_csv_chunks(response.raw, dtype, chunksize, response)
+        # The body is read from the socket while it is parsed, so this stage includes the transfer
+        with _stage('parse'), response:
+            df = pd.read_csv(response.raw, dtype=dtype)
+            _count('bytes', response.raw.tell())
+        return df
+
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_key = hashlib.sha1(endpoint.encode()).hexdigest()
+    data_path = os.path.join(cache_dir, f"{cache_key}.csv")
+    meta_path = os.path.join(cache_dir, f"{cache_key}.json")
+
+    headers = {}
+    if os.path.exists(data_path) and os.path.exists(meta_path):
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    with _stage('download'), session.get(endpoint, auth=auth, headers=headers, stream=True) as response:
+        if response.status_code == 304:
+            logger.info("Data unchanged since last download, using cached copy.")
+        else:
+            response.raise_for_status()
+            fd, tmp_path = tempfile.mkstemp(suffix='.csv', dir=cache_dir)
+            size = 0
+            try:
+                with os.fdopen(fd, 'wb') as tmp_file:
+                    for block in response.iter_content(chunk_size=1024 * 1024):
+                        tmp_file.write(block)
+                        size += len(block)
+                os.replace(tmp_path, data_path)
+                _count('bytes', size)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            with open(meta_path, 'w') as meta_file:
+                json.dump({
+                    'etag': response.headers.get('ETag'),
+                    'last_modified': response.headers.get('Last-Modified'),
+                }, meta_file)
+
+    if chunksize is not None:
+        return _read_csv_chunks(data_path, dtype, chunksize)
+    with _stage('parse'):
+        return pd.read_csv(data_path, dtype=dtype)
+
+def _read_csv_chunks(source, dtype, chunksize, response=None):
+    """
+    Yield the DataFrame chunks of a CSV file or stream. The reader, and the HTTP `response` the stream comes from,
+    are closed once the chunks are exhausted or the caller stops iterating, so the pooled connection is released.
+    """
+    try:
+        with pd.read_csv(source, dtype=dtype, chunksize=chunksize) as reader:
+            for chunk in reader:
+                yield chunk
+    finally:
+        if response is not None:
+            response.close()
+
+@_instrumented
+def download_surveycto_photo(url, username, password):
+    try:
+        with _stage('download', url=url):
+            response = requests.get(url, auth=(username, password), stream=True)
+            response.raise_for_status()
+            content = response.content
+        _count('bytes', len(content))
+        return content
+    except requests.exceptions.RequestException:
+        logger.exception("Error downloading the photo")
+        _count('errors', 1)
+        return None
+
+@_instrumented
+def download_surveycto_photos(urls, save_dir, username, password, max_workers=8, retries=3, backoff=1.0, previous_manifest=None):
+    """
+    Download many SurveyCTO attachments to a folder with bounded concurrency over a pooled, authenticated session.
+
+    Parameters:
+    - urls (list or pandas.Series): Attachment URLs, e.g. a photo column of a submissions DataFrame. Empty values are ignored.
+    - save_dir (str): Folder the files are saved to (created if needed). Files are named after the last part of the URL,
+      prefixed with a hash of the whole URL, so a URL always maps to the same file whatever else is in the batch.
+    - username (str): The SurveyCTO username for authentication.
+    - password (str): The SurveyCTO password for authentication.
+    - max_workers (int): Number of downloads running at the same time. Default is 8.
+    - retries (int): Number of retries for connection errors and 429/5xx responses. Default is 3.
+    - backoff (float): Base delay in seconds between retries, doubled after every attempt. Default is 1.0.
+    - previous_manifest (pandas.DataFrame): Manifest of an earlier run. Files whose local SHA-256 still matches it are
+      skipped without contacting the server.
+
+    Returns:
+    - pandas.DataFrame: Manifest with one row per URL and the columns
+      'url', 'path', 'status' ('downloaded', 'skipped' or 'failed'), 'bytes', 'sha256', 'attempts' and 'error'.
+
+    Notes:
+    - Bodies are streamed to disk in 1 MiB chunks and moved into place only once complete.
+    - Without a `previous_manifest` entry for a URL its file is downloaded again, even if it already exists.
+    """
+    urls = [url for url in dict.fromkeys(pd.Series(list(urls), dtype=object).dropna()) if str(url).strip()]
+    os.makedirs(save_dir, exist_ok=True)
+
+    known_hashes = {}
+    if previous_manifest is not None and len(previous_manifest):
+        known = previous_manifest.dropna(subset=['sha256'])
+        known_hashes = dict(zip(known['url'], known['sha256']))
+
+    paths = [os.path.join(save_dir, _attachment_file_name(url)) for url in urls]
+
+    with _stage('download', files=len(urls)), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        records = list(executor.map(
+            lambda item: _download_attachment(item[0], item[1], (username, password), retries, backoff, known_hashes.get(item[0])),
+            zip(urls, paths),
+        ))
+    manifest = pd.DataFrame(records, columns=['url', 'path', 'status', 'bytes', 'sha256', 'attempts', 'error'])
+    downloaded = manifest['status'] == 'downloaded'
+    _count('files', int(downloaded.sum()))
+    _count('bytes', int(manifest.loc[downloaded, 'bytes'].sum()))
+    _count('errors', int((manifest['status'] == 'failed').sum()))
+    logger.info("Photos downloaded: %d, skipped: %d, failed: %d", downloaded.sum(),
+                (manifest['status'] == 'skipped').sum(), (manifest['status'] == 'failed').sum())
+    return manifest
+
+def _attachment_file_name(url):
+    """ File name for an attachment URL: a hash of the URL followed by its unquoted last path segment """
+    url_hash = hashlib.sha1(url.encode()).hexdigest()
+    name = os.path.basename(unquote(urlparse(url).path))
+    return f"{url_hash[:10]}_{name}" if name else url_hash
+
+def _file_sha256(path):
+    """ SHA-256 of a file, read in 1 MiB chunks """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _download_attachment(url, path, auth, retries, backoff, known_hash=None):
+    """ Download one attachment to `path` with retries; returns a manifest record """
+    if known_hash and os.path.exists(path):
+        local_hash = _file_sha256(path)
+        if local_hash == known_hash:
+            return [url, path, 'skipped', os.path.getsize(path), local_hash, 0, None]
+
+    error = None
+    for attempt in range(1, retries + 2):
+        try:
+            with _http_session().get(url, auth=auth, stream=True) as response:
+                if response.status_code == 429 or response.status_code >= 500:
+                    response.raise_for_status()
+                if response.status_code >= 400:
+                    return [url, path, 'failed', None, None, attempt, f"HTTP {response.status_code}"]
+
+                digest = hashlib.sha256()
+                size = 0
+                tmp_path = f"{path}.part"
+                with open(tmp_path, 'wb') as file:
+                    for block in response.iter_content(chunk_size=1024 * 1024):
+                        file.write(block)
+                        digest.update(block)
+                        size += len(block)
+                os.replace(tmp_path, path)
+                return [url, path, 'downloaded', size, digest.hexdigest(), attempt, None]
+        except (requests.exceptions.RequestException, OSError) as e:
+            error = str(e)
+            if attempt <= retries:
+                time.sleep(backoff * 2 ** (attempt - 1))
+    if os.path.exists(f"{path}.part"):
+        os.remove(f"{path}.part")
+    return [url, path, 'failed', None, None, retries + 1, error]
+
+@_instrumented
+def save_photo_from_bytes(photo_bytes, save_path):
+    try:
+        with open(save_path, 'wb') as file:
+            file.write(photo_bytes)
+        _count('bytes', len(photo_bytes))
+        logger.info("Photo successfully saved: %s", save_path)
+    except Exception:
+        logger.exception("Error saving photo")
+        _count('errors', 1)
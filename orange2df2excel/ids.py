@@ -0,0 +1,359 @@
+"""Session and beneficiary ID generation, and the persistent ID index."""
+from datetime import datetime
+import re
+import sqlite3
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from .metrics import _instrumented, _count, _stage
+
+logger = logging.getLogger(__name__)
+
+@_instrumented
+def generate_session_id(df, donor_name, location_settlement, name_enumerator, session_date, project_name, total_bnf, comment, girls_final, boys_final, women_final, men_final, copy=False, columns=None, rows=None):
+    """
+    Generates a unique session ID.
+
+    Parameters:
+        df (dataframe): DataFrame of the data
+        donor_name (str): Name of the column for donor name
+        location_settlement (str): Name of the column for settlement
+        name_enumerator (str): Name of the column for enumerator
+        submission_date (str): Name of the column for submission date
+        session_date (str): Name of the column for session date
+        project_name (str): Name of the project
+        total_bnf (str): Name of the column for total beneficiaries
+        comment (str): Name of the column for comments
+        copy (bool): If True, work on a copy and leave the caller's DataFrame untouched. Default is False.
+        columns (list): With copy=True, only these columns (plus 'session_id_sql') are copied into the result.
+            Passing it without copy=True raises a ValueError, since the caller's DataFrame is modified in place.
+        rows (pandas.Series or array of bool): If set, only compute IDs for these rows (e.g. rows that are new since
+            the last run); other rows keep their existing 'session_id_sql' value.
+
+    Returns:
+        df: The initial dataframe with a new column named 'session_id_sql' containing the unique session ID.
+    """
+    import pandas as pd
+
+    if columns is not None and not copy:
+        raise ValueError("columns can only be used with copy=True.")
+    if copy:
+        df = df[columns].copy() if columns is not None else df.copy()
+    
+    # Handle missing or null comments by replacing them with 'XXX'
+    df[comment] = df[comment].fillna('XXX')
+
+    source = df if rows is None else df.loc[rows]
+    _count('rows', len(source))
+    # Every column is normalized once per distinct value and the ID is assembled with a single join
+    session_ids = _map_unique(source[donor_name], _session_key).str.cat([
+        pd.Series(project_name, index=source.index, dtype=object),
+        _map_unique(source[location_settlement], _session_key),
+        _map_unique(source[name_enumerator], lambda values: values.str[:3].str.translate(_SESSION_ID_STRIP).str.upper()),
+        _map_unique(source[session_date], _session_key),
+        _map_unique(source[total_bnf], lambda values: values.astype(str)),
+        _map_unique(source[comment], lambda values: values.str.len().astype(str)),
+        _map_unique(source[girls_final], lambda values: values.astype(str)),
+        _map_unique(source[boys_final], lambda values: values.astype(str)),
+        _map_unique(source[women_final], lambda values: values.astype(str)),
+        _map_unique(source[men_final], lambda values: values.astype(str)),
+    ], sep='-')
+
+    # Create the unique session ID, with the dtype pandas gives a concatenation of text columns (str on pandas 3)
+    if rows is None or 'session_id_sql' not in df.columns:
+        df['session_id_sql'] = session_ids.infer_objects()
+    else:
+        df['session_id_sql'] = df['session_id_sql'].astype(object)
+        df.loc[session_ids.index, 'session_id_sql'] = session_ids
+        df['session_id_sql'] = df['session_id_sql'].infer_objects()
+
+    return df
+
+_SESSION_ID_STRIP = str.maketrans('', '', ' :,')
+
+def _session_key(values):
+    """ Session ID normalization of a text column: drop spaces, colons and commas, upper-case, strip """
+    return values.str.translate(_SESSION_ID_STRIP).str.upper().str.strip()
+
+def _map_unique(series, transform):
+    """
+    Apply a vectorized `transform` to the distinct values of `series` only and broadcast the result back.
+    Missing values are kept as a distinct value, so the transform sees the same dtype as the full column.
+    """
+    import pandas as pd
+
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    transformed = transform(pd.Series(uniques, dtype=series.dtype)).to_numpy(dtype=object)
+    return pd.Series(transformed[codes], index=series.index, dtype=object)
+
+def generate_bnf_id(name, surname, dob):
+    """
+    Generates a unique beneficiary ID with a hash as the final component.
+
+    Parameters:
+        name (str): First name of the person.
+        surname (str): Last name of the person.
+        dob (str): Date of birth in 'YYYY-MM-DD' format.
+
+    Returns:
+        str: Generated unique beneficiary ID with hash included.
+    """
+    surname_length = len(surname)
+    surname_part = surname[:3].upper().ljust(3, 'X')  # Pads with 'X' if fewer than 3 letters
+    name_part = name[:3].upper().ljust(3, 'X')
+    
+    # Convert DOB from 'YYYY-MM-DD' to 'DDMMYY' format
+    dob_parts = dob.split("-")
+    dob_formatted = dob_parts[2] + dob_parts[1] + dob_parts[0][2:]  # DDMMYY format
+
+    to_hash = f'{surname}{name}{dob_parts}'
+    
+    base_id = f"{surname_length}-{surname_part}-{name_part}-{dob_formatted}"
+    hash_suffix = hashlib.md5(to_hash.encode()).hexdigest()
+    beneficiary_id = f"{base_id}-{hash_suffix}"
+    
+    return beneficiary_id
+
+@_instrumented
+def generate_bnf_ids(df, name_col, surname_col, dob_col, id_col='bnf_id', error_col='bnf_id_error', max_workers=None, batch_size=100000):
+    """
+    Generates beneficiary IDs for a whole DataFrame, identical to calling `generate_bnf_id` row by row.
+
+    Parameters:
+        df (dataframe): DataFrame of the registrations
+        name_col (str): Name of the column for first names
+        surname_col (str): Name of the column for last names
+        dob_col (str): Name of the column for dates of birth in 'YYYY-MM-DD' format
+        id_col (str): Name of the column the IDs are written to. Default is 'bnf_id'.
+        error_col (str): Name of the column describing rows without an ID, or None to leave it out.
+            Default is 'bnf_id_error'.
+        max_workers (int): If set, spread batches of rows over a process pool with this many workers.
+        batch_size (int): Number of rows per batch when using a process pool. Default is 100000.
+
+    Returns:
+        df: A copy of the dataframe with the ID column (null where the row is invalid) and the error column.
+    """
+    import pandas as pd
+
+    names, surnames, dobs = df[name_col], df[surname_col], df[dob_col]
+    if max_workers:
+        starts = range(0, len(df), batch_size)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(
+                _bnf_ids,
+                [names.iloc[start:start + batch_size] for start in starts],
+                [surnames.iloc[start:start + batch_size] for start in starts],
+                [dobs.iloc[start:start + batch_size] for start in starts],
+            ))
+        ids = pd.concat([result[0] for result in results]) if results else pd.Series(dtype=object)
+        errors = pd.concat([result[1] for result in results]) if results else pd.Series(dtype=object)
+    else:
+        ids, errors = _bnf_ids(names, surnames, dobs)
+    _count('rows', len(df))
+    _count('invalid_rows', int(ids.isna().sum()))
+
+    result = df.copy()
+    result[id_col] = ids.values
+    if error_col:
+        result[error_col] = errors.values
+    return result
+
+def _bnf_ids(names, surnames, dobs):
+    """
+    `generate_bnf_id` over three Series; returns (ids, errors) with nulls where not applicable.
+    Prefixes, lengths and date parts are computed once per distinct value, so only the hash runs per row.
+    """
+    import pandas as pd
+
+    surname_parts = _per_unique(surnames, lambda surname: (surname, f"{len(surname)}-{surname[:3].upper().ljust(3, 'X')}"))
+    name_parts = _per_unique(names, lambda name: (name, name[:3].upper().ljust(3, 'X')))
+    dob_parts = _per_unique(dobs, _bnf_dob_parts)
+
+    ids = [None] * len(names)
+    errors = [None] * len(names)
+    for row, (surname, name, dob) in enumerate(zip(surname_parts, name_parts, dob_parts)):
+        if surname is None or name is None or dob is None:
+            errors[row] = "name, surname and dob must be strings"
+        elif dob is False:
+            errors[row] = "dob must be in 'YYYY-MM-DD' format"
+        else:
+            to_hash = f'{surname[0]}{name[0]}{dob[1]}'
+            ids[row] = f"{surname[1]}-{name[1]}-{dob[0]}-{hashlib.md5(to_hash.encode()).hexdigest()}"
+    return pd.Series(ids, index=names.index, dtype=object), pd.Series(errors, index=names.index, dtype=object)
+
+def _bnf_dob_parts(dob):
+    """ (DDMMYY, str of the split parts as hashed by `generate_bnf_id`), or False for an invalid date """
+    dob_parts = dob.split("-")
+    if len(dob_parts) < 3:
+        return False
+    return dob_parts[2] + dob_parts[1] + dob_parts[0][2:], str(dob_parts)
+
+def _per_unique(series, transform):
+    """ Object array holding `transform(value)` for every string value of `series` (None otherwise), computed once per distinct value """
+    import pandas as pd
+    import numpy as np
+
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    transformed = np.empty(len(uniques), dtype=object)
+    transformed[:] = [transform(value) if isinstance(value, str) else None for value in uniques]
+    return transformed[codes]
+
+def _canonical_text(series):
+    """ Object array holding `series` as text whatever its dtype (5, 5.0 and '5' all give '5'), None where missing """
+    import pandas as pd
+    import numpy as np
+
+    codes, uniques = pd.factorize(series)
+    texts = np.empty(len(uniques) + 1, dtype=object)
+    texts[:-1] = [str(int(value)) if isinstance(value, float) and value.is_integer() else str(value) for value in uniques]
+    texts[-1] = None
+    return texts[codes]
+
+class IdIndex:
+    """
+    Local persistent index of generated IDs (e.g. `bnf_id`, `session_id_sql`) backed by SQLite.
+
+    Each ID is stored with a 64-bit fingerprint of the row values it was generated from, so an incoming batch can be
+    classified against the whole history in one call: lookups go through the primary key index, so the cost grows
+    with the batch size and not with the history size.
+
+    Parameters:
+        path (str): Path of the SQLite database file (created if needed).
+        table (str): Name of the table holding the IDs. Default is 'ids'.
+
+    Example:
+        with IdIndex("ids.sqlite") as index:
+            df['status'] = index.classify(df, 'bnf_id', ['name', 'surname', 'dob'])
+            index.upsert(df, 'bnf_id', ['name', 'surname', 'dob'])
+    """
+
+    def __init__(self, path, table='ids'):
+        if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', table):
+            raise ValueError(f"Invalid table name: {table}")
+        self.table = table
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} (id TEXT PRIMARY KEY, fingerprint INTEGER, updated_at TEXT) WITHOUT ROWID"
+        )
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+    @_instrumented
+    def contains(self, ids):
+        """
+        Bulk membership check.
+
+        Parameters:
+            ids (list or pandas.Series): IDs to look up.
+
+        Returns:
+            pandas.Series: Booleans, True where the ID is already in the index.
+        """
+        import pandas as pd
+
+        ids = pd.Series(list(ids) if not isinstance(ids, pd.Series) else ids)
+        _count('rows', len(ids))
+        known = self._lookup(ids)
+        return ids.astype(str).isin(known.keys()) & ids.notna()
+
+    @_instrumented
+    def classify(self, df, id_col, value_cols=None):
+        """
+        Mark every row of a batch as 'new', 'duplicate' or 'changed' compared to the index.
+
+        Parameters:
+            df (dataframe): The incoming batch.
+            id_col (str): Name of the ID column.
+            value_cols (list): Columns whose values are fingerprinted. A known ID whose fingerprint differs is
+                'changed'. If None, known IDs are always 'duplicate'.
+
+        Returns:
+            pandas.Series: The status of each row (null where the ID is missing). An ID repeated inside the batch is
+            'duplicate' after its first occurrence.
+        """
+        import pandas as pd
+
+        ids = df[id_col]
+        _count('rows', len(df))
+        fingerprints = self._fingerprints(df, value_cols)
+        known = self._lookup(ids)
+
+        keys = ids.astype(str)
+        stored = keys.map(known)
+        status = pd.Series('new', index=df.index, dtype=object)
+        is_known = keys.isin(known.keys())
+        status[is_known] = 'duplicate'
+        if fingerprints is not None:
+            status[is_known & stored.notna() & (stored != fingerprints)] = 'changed'
+        status[ids.duplicated() & (status == 'new')] = 'duplicate'
+        status[ids.isna()] = None
+        return status
+
+    @_instrumented
+    def upsert(self, df, id_col, value_cols=None):
+        """
+        Insert new IDs and update the fingerprints of known ones, in a single transaction.
+
+        Parameters:
+            df (dataframe): The batch to store.
+            id_col (str): Name of the ID column. Rows with a missing ID are ignored.
+            value_cols (list): Columns whose values are fingerprinted (see `classify`).
+
+        Returns:
+            int: The number of rows written.
+        """
+        mask = df[id_col].notna()
+        ids = df.loc[mask, id_col].astype(str)
+        fingerprints = self._fingerprints(df[mask], value_cols)
+        fingerprints = fingerprints.tolist() if fingerprints is not None else [None] * len(ids)
+        updated_at = datetime.now().isoformat(timespec='seconds')
+        with _stage('write', table=self.table), self.connection:
+            self.connection.executemany(
+                f"INSERT INTO {self.table} (id, fingerprint, updated_at) VALUES (?, ?, ?) "
+                f"ON CONFLICT(id) DO UPDATE SET fingerprint = excluded.fingerprint, updated_at = excluded.updated_at",
+                zip(ids.tolist(), fingerprints, [updated_at] * len(ids)),
+            )
+        _count('rows', len(ids), table=self.table)
+        return len(ids)
+
+    @staticmethod
+    def _fingerprints(df, value_cols):
+        """
+        Signed 64-bit hash of the given columns of every row (SQLite integers are signed).
+        Values are hashed as text (see `_canonical_text`), so a column read as int64 in one batch and as float64
+        (because of a missing value) or text in the next keeps the same fingerprints.
+        """
+        import pandas as pd
+        import numpy as np
+
+        if not value_cols:
+            return None
+        canonical = pd.DataFrame({position: _canonical_text(df[column]) for position, column in enumerate(value_cols)},
+                                 index=df.index)
+        return pd.util.hash_pandas_object(canonical, index=False).astype(np.int64)
+
+    def _lookup(self, ids):
+        """ Fetch {id: fingerprint} for the IDs of a batch through a temporary table join """
+        keys = list(dict.fromkeys(ids[ids.notna()].astype(str)))
+        with _stage('lookup', table=self.table), self.connection:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS _batch_ids (id TEXT PRIMARY KEY) WITHOUT ROWID")
+            self.connection.execute("DELETE FROM _batch_ids")
+            self.connection.executemany("INSERT INTO _batch_ids (id) VALUES (?)", ((key,) for key in keys))
+            rows = self.connection.execute(
+                f"SELECT i.id, i.fingerprint FROM _batch_ids b JOIN {self.table} i ON i.id = b.id"
+            ).fetchall()
+        return dict(rows)
@@ -0,0 +1,86 @@
+"""Logging helpers, timing spans and counters shared by the other modules, and the metrics hook registry."""
+import contextvars
+import functools
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+_METRICS_HOOKS = ()
+_OPERATION = contextvars.ContextVar('orange2df2excel_operation', default=None)
+
+def add_metrics_hook(hook):
+    """
+    Register a callable that receives every timing and counter event emitted by the library.
+
+    Parameters:
+    - hook: callable - Called as `hook(event)` with a dict holding:
+        - 'type': str - 'timing' (value in seconds) or 'counter'.
+        - 'operation': str - Public function the event belongs to, e.g. 'raw_data_to_excel'.
+        - 'name': str - Stage ('download', 'parse', 'normalize', 'write_rows', 'autofit', 'save', ..., and 'total'
+          for the whole call) or counter ('rows', 'bytes', 'files', 'errors').
+        - 'value': float - Seconds for timings, the increment for counters.
+        - 'tags': dict - Extra context, e.g. the file path.
+      Hooks run synchronously in the thread that emits the event; an exception raised by a hook is logged and ignored.
+
+    Returns:
+    - The hook itself, so this can be used as a decorator.
+    """
+    global _METRICS_HOOKS
+    _METRICS_HOOKS = _METRICS_HOOKS + (hook,)
+    return hook
+
+def remove_metrics_hook(hook):
+    """ Unregister a hook added with `add_metrics_hook`. Unknown hooks are ignored. """
+    global _METRICS_HOOKS
+    _METRICS_HOOKS = tuple(registered for registered in _METRICS_HOOKS if registered is not hook)
+
+def _emit(event_type, name, value, tags):
+    """ Pass one event to every registered hook """
+    if not _METRICS_HOOKS:
+        return
+    event = {'type': event_type, 'operation': _OPERATION.get(), 'name': name, 'value': value, 'tags': tags}
+    for hook in _METRICS_HOOKS:
+        try:
+            hook(event)
+        except Exception:
+            logger.exception("Metrics hook %r failed", hook)
+
+@contextmanager
+def _stage(name, **tags):
+    """ Time the enclosed block as stage `name` of the current operation """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        logger.debug("%s: %s took %.3fs", _OPERATION.get(), name, elapsed)
+        _emit('timing', name, elapsed, tags)
+
+def _count(name, value, **tags):
+    """ Emit counter `name` (rows, bytes, ...) for the current operation """
+    logger.debug("%s: %s += %s", _OPERATION.get(), name, value)
+    _emit('counter', name, value, tags)
+
+def _instrumented(func):
+    """ Make `func` an operation: stages and counters inside it are attributed to it, and the whole call is timed as 'total' """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _OPERATION.set(func.__qualname__)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            _count('errors', 1)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            logger.debug("%s finished in %.3fs", func.__qualname__, elapsed)
+            _emit('timing', 'total', elapsed, {})
+            _OPERATION.reset(token)
+    return wrapper
+
+def _submit(executor, fn, *args):
+    """ `executor.submit` running `fn` in a copy of the current context, so its metrics keep the caller's operation """
+    return executor.submit(contextvars.copy_context().run, fn, *args)
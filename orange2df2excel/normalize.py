@@ -0,0 +1,290 @@
+"""Normalizing nested survey submissions (KoBo repeat groups) into compact DataFrames."""
+import itertools
+import json
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+from .metrics import _instrumented, _stage, _count
+
+logger = logging.getLogger(__name__)
+
+MAIN_TABLE = 'submissions'
+
+_INTEGER = re.compile(r'[+-]?(0|[1-9]\d*)')
+_LEADING_ZERO = re.compile(r'[+-]?0\d+')
+_ISO_DATETIME = re.compile(r'\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?)?')
+_TIMEZONE = re.compile(r'(?:Z|[+-]\d{2}:?\d{2})$')
+
+# XLSForm question types understood by `column_types`
+_TYPE_KINDS = {
+    'select_one': 'category',
+    'integer': 'integer',
+    'decimal': 'float',
+    'range': 'float',
+    'date': 'datetime',
+    'datetime': 'datetime',
+    'start': 'datetime',
+    'end': 'datetime',
+    'today': 'datetime',
+    'text': 'text',
+}
+
+@_instrumented
+def normalize_kobo_submissions(submissions, chunk_size=10000, categorical_threshold=0.5, column_types=None):
+    """
+    Flatten KoBoToolbox submissions into one table per repeat group, with compact dtypes.
+
+    Every repeat group (a list of dicts whose keys start with the group's path, e.g. "members": [{"members/name": ...}])
+    is moved out of the submission into its own table. Child rows are keyed like KoBo's own exports:
+    - '_id': the `_id` of the submission the row belongs to.
+    - '_index': position of the row within its repeat group (1-based).
+    - '_parent_index': for a repeat nested in another repeat, the '_index' of the parent row.
+    Repeat groups answered zero times are dropped. Other lists, such as `_attachments` and `_tags`, are stored as JSON
+    text (empty lists as missing values), so every table can be written to Excel.
+
+    Submissions are processed `chunk_size` at a time and each chunk is converted to compact dtypes (see
+    `compact_dtypes`) before the next one is read, so only the compact tables and one chunk of JSON are kept.
+
+    Parameters:
+    - submissions: iterable of dict - The `results` of the KoBo data API. A generator is consumed chunk by chunk.
+    - chunk_size: int - Number of submissions normalized at a time. Default is 10000.
+    - categorical_threshold: float - See `compact_dtypes`. Default is 0.5.
+    - column_types: dict - See `compact_dtypes`.
+
+    Returns:
+    - dict: Table name to pandas.DataFrame. The submissions are under 'submissions'; each repeat group is under the last
+      part of its path (e.g. "household/members" -> 'members'), or its full path with '.' if that name is taken.
+      The tables can be passed to `raw_data_to_excel_batch` as sheets.
+    """
+    return _normalize_kobo(submissions, chunk_size, categorical_threshold, column_types)
+
+def _normalize_kobo(submissions, chunk_size=10000, categorical_threshold=0.5, column_types=None):
+    """ Uninstrumented body of `normalize_kobo_submissions`, for use inside other instrumented functions """
+    submissions = iter(submissions)
+    chunks = {}
+    n_submissions = 0
+    while True:
+        records = list(itertools.islice(submissions, chunk_size))
+        if not records:
+            break
+        with _stage('normalize', rows=len(records)):
+            tables = _split_repeat_groups(records)
+        del records
+        with _stage('compact'):
+            for path, rows in tables.items():
+                chunks.setdefault(path, []).append(
+                    _compact_dtypes(pd.json_normalize(rows), categorical_threshold, column_types)
+                )
+        n_submissions += len(tables[None])
+        _count('rows', len(tables[None]))
+
+    with _stage('merge'):
+        result = {MAIN_TABLE: _concat_compact(chunks.pop(None, []), categorical_threshold, column_types)}
+        for path, frames in chunks.items():
+            result[_table_name(path, result)] = _concat_compact(frames, categorical_threshold, column_types)
+    logger.info("%d submissions normalized into %d tables", n_submissions, len(result))
+    return result
+
+@_instrumented
+def compact_dtypes(df, categorical_threshold=0.5, column_types=None):
+    """
+    Convert text columns of survey data to compact dtypes.
+
+    KoBo and SurveyCTO deliver every answer as text. Each text column is converted, in this order, to:
+    - nullable integers ('Int8' ... 'Int64', the smallest that fits) if every value is a whole number
+      (values with leading zeros, such as phone numbers or codes, stay text),
+    - floats if every value is a number,
+    - datetimes if every value is an ISO date or date-time (values with a UTC offset are converted to UTC and
+      stored without a time zone, which Excel cannot hold),
+    - categoricals if the column has at most `categorical_threshold` distinct values per value (select_one answers),
+    - otherwise it stays text. Columns that are not text (numbers, lists, dicts) are left as they are.
+
+    Parameters:
+    - df: pandas.DataFrame - The data.
+    - categorical_threshold: float - Largest ratio of distinct to non-missing values for a categorical column.
+      Default is 0.5; 0 disables categoricals.
+    - column_types: dict - Column name to XLSForm question type ('select_one', 'integer', 'decimal', 'date',
+      'datetime', 'text', ...), to override the inference, e.g. {'household_code': 'text'}.
+
+    Returns:
+    - pandas.DataFrame: A new DataFrame with the converted columns.
+    """
+    return _compact_dtypes(df, categorical_threshold, column_types)
+
+def _compact_dtypes(df, categorical_threshold=0.5, column_types=None):
+    """ Uninstrumented body of `compact_dtypes`, called once per table and chunk while normalizing """
+    column_types = column_types or {}
+    columns = [
+        _compact_series(df.iloc[:, position], categorical_threshold,
+                        _TYPE_KINDS.get(str(column_types.get(column, '')).split(' ')[0]))
+        for position, column in enumerate(df.columns)
+    ]
+    if not columns:
+        return df.copy()
+    result = pd.concat(columns, axis=1)
+    result.columns = df.columns
+    return result
+
+def _is_repeat_group(key, value):
+    """ True for a KoBo repeat group: a non-empty list of dicts whose keys all start with `key/` """
+    if not isinstance(value, list) or not value:
+        return False
+    prefix = f"{key}/"
+    return all(isinstance(item, dict) and all(name.startswith(prefix) for name in item) for item in value)
+
+def _split_repeat_groups(records):
+    """ Split submissions into {None: submission rows, repeat path: child rows} """
+    tables = {None: []}
+
+    def split(record, submission_id, parent_index):
+        row = {}
+        for key, value in record.items():
+            if value == [] and not key.startswith('_'):
+                # A repeat group answered zero times; KoBo's own lists (_tags, _notes, ...) start with '_'
+                continue
+            if not _is_repeat_group(key, value):
+                # Other lists (_attachments, _tags, _geolocation) become JSON text
+                row[key] = (json.dumps(value) if value else None) if isinstance(value, list) else value
+                continue
+            rows = tables.setdefault(key, [])
+            for index, item in enumerate(value, start=1):
+                child = {'_id': submission_id, '_index': index}
+                if parent_index is not None:
+                    child['_parent_index'] = parent_index
+                child.update(split(item, submission_id, index))
+                rows.append(child)
+        return row
+
+    for record in records:
+        tables[None].append(split(record, record.get('_id'), None))
+    return tables
+
+def _table_name(path, taken):
+    """ Name of the table of a repeat group: the last part of its path, or the whole path if that is taken """
+    name = path.rsplit('/', 1)[-1]
+    if name in taken:
+        name = path.replace('/', '.')
+    return name
+
+def _compact_series(series, categorical_threshold, kind=None):
+    """ Compact dtype for one column; `kind` forces 'integer', 'float', 'datetime', 'category' or 'text' """
+    if kind == 'text':
+        return series
+    values = series.dropna()
+    if values.empty or pd.api.types.infer_dtype(values, skipna=True) != 'string':
+        return series
+
+    uniques = pd.Series(values.unique()).str.strip()
+    if kind in (None, 'integer', 'float'):
+        numbers = pd.to_numeric(uniques, errors='coerce')
+        # Leading zeros mark codes and phone numbers, which must stay text
+        numeric = kind is not None or (numbers.notna().all() and not uniques.str.fullmatch(_LEADING_ZERO).any())
+        if numeric:
+            converted = pd.to_numeric(series.str.strip(), errors='coerce')
+            if kind == 'integer':
+                converted = converted.where(converted % 1 == 0)
+                return converted.astype(_smallest_int(converted))
+            if kind is None and uniques.str.fullmatch(_INTEGER).all() and numbers.abs().max() < 2 ** 63:
+                return converted.astype(_smallest_int(numbers))
+            return converted.astype('float64')
+    if kind in (None, 'datetime'):
+        if kind is not None or uniques.str.fullmatch(_ISO_DATETIME).all():
+            aware = uniques.str.contains(_TIMEZONE).any()
+            converted = pd.to_datetime(series.str.strip(), errors='coerce', format='ISO8601', utc=aware)
+            return converted.dt.tz_localize(None) if aware else converted
+    if kind == 'category' or (kind is None and len(uniques) <= categorical_threshold * len(values)):
+        return series.astype('category')
+    return series
+
+def _smallest_int(numbers):
+    """ Smallest nullable integer dtype holding every value of `numbers` """
+    low, high = numbers.min(), numbers.max()
+    for dtype in ('Int8', 'Int16', 'Int32'):
+        limits = np.iinfo(dtype.lower())
+        if pd.isna(low) or (limits.min <= low and high <= limits.max):
+            return dtype
+    return 'Int64'
+
+def _dtype_kind(dtype):
+    """ Broad kind of a dtype, to tell whether chunks of one column can be concatenated as they are """
+    if isinstance(dtype, pd.CategoricalDtype):
+        return 'category'
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'bool'
+    if pd.api.types.is_numeric_dtype(dtype):
+        return 'number'
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'datetime'
+    return 'other'
+
+def _concat_compact(frames, categorical_threshold, column_types):
+    """
+    Concatenate compacted chunks of one table. Categories are merged; a column whose chunks got different kinds of
+    dtype (e.g. numbers in one chunk, text in the next) is turned back into text and inferred again on all rows.
+    """
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    columns = list(dict.fromkeys(column for frame in frames for column in frame.columns))
+    frames = [frame.copy(deep=False) for frame in frames]
+    retype = []
+    for column in columns:
+        pieces = [frame[column] for frame in frames if column in frame.columns]
+        typed = [piece for piece in pieces if piece.notna().any()]
+        kinds = {_dtype_kind(piece.dtype) for piece in typed}
+        if len(kinds) > 1:
+            for frame in frames:
+                if column in frame.columns:
+                    frame[column] = _as_text(frame[column])
+            retype.append(column)
+            continue
+        if kinds == {'category'}:
+            dtype = pd.CategoricalDtype(pd.api.types.union_categoricals(typed).categories)
+        elif kinds:
+            dtype = pd.concat([piece.iloc[:0] for piece in typed]).dtype
+        else:
+            continue
+        if dtype == object:
+            continue
+        # All-null pieces (object dtype) and chunks without the column would otherwise turn the column into object
+        for frame in frames:
+            if column in frame.columns:
+                frame[column] = frame[column].astype(dtype)
+            else:
+                frame[column] = pd.Series(None, index=frame.index, dtype=object).astype(dtype)
+    result = pd.concat(frames, ignore_index=True)
+    for column in retype:
+        result[column] = _compact_dtypes(result[[column]], categorical_threshold, column_types)[column]
+    return result
+
+def _merge_tables(parts, categorical_threshold=0.5, column_types=None):
+    """ Concatenate several {table name: DataFrame} results (e.g. one per page) table by table """
+    names = dict.fromkeys(name for part in parts for name in part)
+    return {
+        name: _concat_compact([part[name] for part in parts if name in part], categorical_threshold, column_types)
+        for name in names
+    }
+
+def _replace_submissions(cached, new):
+    """ Merge newly fetched tables into cached ones: every table drops the cached rows of re-fetched submissions """
+    new_main = new.get(MAIN_TABLE, pd.DataFrame())
+    if '_id' not in new_main.columns:
+        return _merge_tables([cached, new])
+    new_ids = set(new_main['_id'])
+    kept = {
+        name: table[~table['_id'].isin(new_ids)] if '_id' in table.columns else table
+        for name, table in cached.items()
+    }
+    return _merge_tables([kept, new])
+
+def _as_text(series):
+    """ Turn a compacted column back into text, keeping missing values missing """
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        text = series.dt.strftime('%Y-%m-%dT%H:%M:%S')
+    else:
+        text = series.astype(object).map(str)
+    return text.where(series.notna(), None).astype(object)
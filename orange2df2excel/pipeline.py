@@ -0,0 +1,274 @@
+"""Chunked streaming pipelines connecting the fetch, transform, encryption and export functions."""
+import contextvars
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+
+from .metrics import _instrumented, _count, _emit
+
+logger = logging.getLogger(__name__)
+
+_END = object()
+
+class _Failed:
+    """ Queue item telling the next stages that an earlier stage raised `error` """
+    def __init__(self, error):
+        self.error = error
+
+class _Stopped(Exception):
+    """ Raised inside pipeline threads when the run is being torn down """
+
+def _put(target, item, stop):
+    """ `target.put(item)` that gives up once `stop` is set, so a failed run cannot leave a thread blocked """
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+    raise _Stopped()
+
+def _get(source, stop):
+    """ `source.get()` that gives up once `stop` is set """
+    while not stop.is_set():
+        try:
+            return source.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    raise _Stopped()
+
+def _timed_call(func, chunk, args, kwargs):
+    """ Run a stage function on one chunk; returns (result, seconds). Module level so process pools can pickle it """
+    start = time.perf_counter()
+    result = func(chunk, *args, **kwargs)
+    return result, time.perf_counter() - start
+
+def _stage_name(func):
+    """ Default stage name: the function name, also for `functools.partial` objects """
+    return getattr(func, '__name__', None) or getattr(getattr(func, 'func', None), '__name__', None) or repr(func)
+
+class Pipeline:
+    """
+    Streams DataFrame chunks from a source through a chain of stages into a sink, with bounded queues in between.
+
+    The source, every stage and the sink run concurrently, each in its own thread, so fetching, transforming,
+    encrypting and writing overlap. A stage can spread its chunks over a thread or process pool; chunks always keep
+    their order. At most `queue_size` chunks wait between two stages, so peak memory grows with the chunk size and the
+    number of stages, not with the size of the dataset.
+
+    Parameters:
+        source (iterable of pandas.DataFrame): The chunks to process, e.g. `fetch_surveycto_data(..., chunksize=50000)`.
+        queue_size (int): Maximum number of chunks waiting between two stages. Default is 2.
+
+    Example:
+        pipeline = Pipeline(fetch_surveycto_data(False, server, form_id, username, password, chunksize=50000))
+        pipeline.add_stage(generate_session_id, 'donor', 'settlement', 'enumerator', 'session_date', 'PRJ', 'total',
+                           'comment', 'girls', 'boys', 'women', 'men')
+        pipeline.add_stage(encrypt_columns, ['name', 'phone'], key, executor='process', workers=2)
+        pipeline.set_sink(raw_data_to_excel, 'export.xlsx', 'raw data')
+        stats = pipeline.run()
+    """
+
+    def __init__(self, source, queue_size=2):
+        if source is None:
+            raise ValueError("Pipeline source is None (did the fetch fail?).")
+        if queue_size < 1:
+            raise ValueError("queue_size must be at least 1.")
+        self.source = source
+        self.queue_size = queue_size
+        self.stages = []
+        self.sink = None
+        self.result = None
+
+    def add_stage(self, func, *args, name=None, executor='thread', workers=1, **kwargs):
+        """
+        Append a stage called as `func(chunk, *args, **kwargs)` for every chunk; it must return the transformed chunk.
+
+        Parameters:
+            func (callable): The chunk transformation, e.g. `generate_session_id` or `encrypt_columns`.
+            name (str): Name used in the statistics. Defaults to the function name.
+            executor (str): 'thread' to run in threads, or 'process' to run in worker processes (for CPU-bound work;
+                `func` and its arguments must then be picklable, so no lambdas). Default is 'thread'.
+            workers (int): Number of chunks processed at the same time. Default is 1.
+
+        Returns:
+            Pipeline: The pipeline itself, so calls can be chained.
+        """
+        if executor not in ('thread', 'process'):
+            raise ValueError("executor must be 'thread' or 'process'.")
+        if workers < 1:
+            raise ValueError("workers must be at least 1.")
+        self.stages.append({
+            'name': name or _stage_name(func), 'func': func, 'args': args, 'kwargs': kwargs,
+            'executor': executor, 'workers': workers,
+        })
+        return self
+
+    def set_sink(self, func, *args, name=None, **kwargs):
+        """
+        Set the final stage, called once as `func(chunks, *args, **kwargs)` with an iterator over the processed chunks,
+        e.g. `raw_data_to_excel` or `raw_data_to_excel_with_all_charts`, which stream chunked input.
+
+        Returns:
+            Pipeline: The pipeline itself, so calls can be chained.
+        """
+        self.sink = {'name': name or _stage_name(func), 'func': func, 'args': args, 'kwargs': kwargs}
+        return self
+
+    @_instrumented
+    def run(self):
+        """
+        Run the pipeline until the source is exhausted and the sink has returned. The sink's return value is kept in
+        `self.result`. If any stage raises, the pipeline is stopped and the exception is re-raised here.
+
+        Returns:
+            pandas.DataFrame: One row per stage (source, stages, sink) with the columns
+            - 'stage', 'workers', 'chunks', 'rows'
+            - 'busy_seconds': time spent working on chunks (summed over workers)
+            - 'wall_seconds': time from the start of the run until the stage finished
+            - 'rows_per_second': rows / busy_seconds, the throughput of one worker of the stage
+            - 'utilization': busy_seconds / (wall_seconds * workers); the bottleneck stage is close to 1.
+        """
+        if self.sink is None:
+            raise ValueError("Pipeline has no sink; call set_sink() first.")
+
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(self.stages) + 1)]
+        stats = [self._new_stats('source', 1)]
+        stats += [self._new_stats(stage['name'], stage['workers']) for stage in self.stages]
+        stats.append(self._new_stats(self.sink['name'], 1))
+        errors = []
+        started = time.perf_counter()
+
+        threads = [(self._feed, (queues[0], stats[0], stop))]
+        threads += [
+            (self._run_stage, (stage, queues[position], queues[position + 1], stats[position + 1], stop))
+            for position, stage in enumerate(self.stages)
+        ]
+        threads = [
+            threading.Thread(target=contextvars.copy_context().run, args=(target, *args, started), daemon=True)
+            for target, args in threads
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            self.result = self._drain(queues[-1], stats[-1], stop, errors, started)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        report = pd.DataFrame(stats)
+        report['rows_per_second'] = report['rows'] / report['busy_seconds'].where(report['busy_seconds'] > 0)
+        report['utilization'] = report['busy_seconds'] / (report['wall_seconds'] * report['workers']).where(report['wall_seconds'] > 0)
+        for row in report.fillna(0).itertuples(index=False):
+            logger.info("Stage %s: %d rows in %d chunks, %.0f rows/s, %.0f%% busy",
+                        row.stage, row.rows, row.chunks, row.rows_per_second, 100 * row.utilization)
+            _emit('timing', row.stage, row.busy_seconds, {'workers': row.workers, 'chunks': row.chunks})
+        return report
+
+    @staticmethod
+    def _new_stats(name, workers):
+        return {'stage': name, 'workers': workers, 'chunks': 0, 'rows': 0, 'busy_seconds': 0.0, 'wall_seconds': 0.0}
+
+    @staticmethod
+    def _record(stats, chunk, seconds):
+        stats['chunks'] += 1
+        stats['rows'] += len(chunk)
+        stats['busy_seconds'] += seconds
+        _count('rows', len(chunk), stage=stats['stage'])
+
+    def _feed(self, outbox, stats, stop, started):
+        """ Source thread: pull chunks from the source iterable into the first queue """
+        try:
+            try:
+                chunks = iter(self.source)
+                while True:
+                    start = time.perf_counter()
+                    chunk = next(chunks, _END)
+                    if chunk is _END:
+                        break
+                    self._record(stats, chunk, time.perf_counter() - start)
+                    _put(outbox, chunk, stop)
+                _put(outbox, _END, stop)
+            except _Stopped:
+                raise
+            except Exception as error:
+                _put(outbox, _Failed(error), stop)
+        except _Stopped:
+            pass
+        finally:
+            stats['wall_seconds'] = time.perf_counter() - started
+
+    def _run_stage(self, stage, inbox, outbox, stats, stop, started):
+        """ Stage thread: transform chunks from `inbox` (inline or on a pool) and pass them on in order """
+        executor = None
+        if stage['executor'] == 'process':
+            executor = ProcessPoolExecutor(max_workers=stage['workers'])
+        elif stage['workers'] > 1:
+            executor = ThreadPoolExecutor(max_workers=stage['workers'])
+        pending = deque()
+
+        def forward(result):
+            chunk, seconds = result
+            self._record(stats, chunk, seconds)
+            _put(outbox, chunk, stop)
+
+        try:
+            try:
+                while True:
+                    item = _get(inbox, stop)
+                    if item is _END or isinstance(item, _Failed):
+                        break
+                    if executor is None:
+                        forward(_timed_call(stage['func'], item, stage['args'], stage['kwargs']))
+                        continue
+                    pending.append(executor.submit(_timed_call, stage['func'], item, stage['args'], stage['kwargs']))
+                    if len(pending) >= stage['workers']:
+                        forward(pending.popleft().result())
+                while pending:
+                    forward(pending.popleft().result())
+                _put(outbox, item, stop)
+            except _Stopped:
+                raise
+            except Exception as error:
+                _put(outbox, _Failed(error), stop)
+        except _Stopped:
+            pass
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+            stats['wall_seconds'] = time.perf_counter() - started
+
+    def _drain(self, inbox, stats, stop, errors, started):
+        """ Run the sink in the calling thread over an iterator of the processed chunks """
+        waiting = [0.0]
+
+        def chunks():
+            while True:
+                start = time.perf_counter()
+                item = _get(inbox, stop)
+                waiting[0] += time.perf_counter() - start
+                if item is _END:
+                    return
+                if isinstance(item, _Failed):
+                    errors.append(item.error)
+                    raise item.error
+                self._record(stats, item, 0.0)
+                yield item
+
+        start = time.perf_counter()
+        try:
+            result = self.sink['func'](chunks(), *self.sink['args'], **self.sink['kwargs'])
+        finally:
+            stats['busy_seconds'] = time.perf_counter() - start - waiting[0]
+            stats['wall_seconds'] = time.perf_counter() - started
+        if errors:
+            # The sink swallowed the failure (e.g. it logs errors and returns None): report it anyway
+            raise errors[0]
+        return result
@@ -9,7 +9,7 @@ setup(
     long_description=open("README.md").read(),       # Reads the content of README.md
     long_description_content_type="text/markdown",   # README.md format
     url="https://github.com/yourusername/orange2df2xcel",  # Replace with your GitHub repo URL
-    packages=find_packages(),                        # Finds the sub-packages automatically
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),  # Finds the sub-packages automatically
     install_requires=[                               # Dependencies for your package
         "pandas",
         "openpyxl",
@@ -19,6 +19,9 @@ setup(
         "bcrypt",
         "xlsxwriter"
     ],
+    extras_require={                                 # Optional features: pip install orange2df2excel[columnar]
+        "columnar": ["pyarrow"],
+    },
     classifiers=[                                    # Optional metadata for package indexing
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",